@@ -3,12 +3,12 @@
 {
     "name": "Stock Partner Delivery Window",
     "summary": "Define preferred delivery time windows for partners",
-    "version": "14.0.1.2.1",
+    "version": "14.0.1.3.0",
     "category": "Inventory",
     "author": "Camptocamp, ACSONE SA/NV, Odoo Community Association (OCA)",
     "license": "AGPL-3",
     "website": "https://github.com/OCA/stock-logistics-workflow",
-    "depends": ["base_time_window", "partner_tz", "stock"],
+    "depends": ["base_time_window", "partner_tz", "resource", "stock"],
     "data": ["security/ir.model.access.csv", "views/res_partner.xml"],
     "demo": ["demo/delivery_time_window.xml"],
     "installable": True,
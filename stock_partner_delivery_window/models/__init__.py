@@ -1,3 +1,4 @@
 from . import delivery_time_window
 from . import res_partner
+from . import resource_calendar_leaves
 from . import stock_picking
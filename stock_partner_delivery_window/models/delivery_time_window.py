@@ -21,3 +21,24 @@ class DeliveryTimeWindow(models.Model):
     @api.constrains("partner_id")
     def check_window_no_overlaps(self):
         return super().check_window_no_overlaps()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        # Change the version of the compiled tables of the delivery windows
+        self.env["res.partner"]._bump_delivery_window_versions(records.partner_id.ids)
+        return records
+
+    def write(self, vals):
+        partners = self.partner_id
+        res = super().write(vals)
+        self.env["res.partner"]._bump_delivery_window_versions(
+            (partners | self.partner_id).ids
+        )
+        return res
+
+    def unlink(self):
+        partners = self.partner_id
+        res = super().unlink()
+        self.env["res.partner"]._bump_delivery_window_versions(partners.ids)
+        return res
@@ -1,15 +1,81 @@
 # Copyright 2020 Camptocamp SA
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl)
+from bisect import bisect_right
 from collections import defaultdict
-from datetime import time
+from datetime import datetime, time, timedelta
+from functools import partial
 
-from odoo import _, api, fields, models
+import pytz
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
+from odoo.osv import expression
 from odoo.tools.misc import format_time
 
-from odoo.addons.partner_tz.tools import tz_utils
-
 WORKDAYS = list(range(5))
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+# maximum number of closures skipped when searching the next delivery datetime
+MAX_CLOSURES = 400
+# key of the versions of the delivery windows and of the closing days read or
+# modified in the transaction, in the cursor cache
+VERSIONS = "stock_partner_delivery_window.versions"
+
+
+def week_minute(date_time):
+    """Return the minute of the week of the datetime, 0 being Monday 00:00"""
+    return (
+        date_time.weekday() * DAY_MINUTES
+        + date_time.hour * 60
+        + date_time.minute
+        + date_time.second / 60
+        + date_time.microsecond / 60000000
+    )
+
+
+def compile_delivery_window_table(rows, utc_offset):
+    """Compile delivery windows in a weekly table
+
+    The table is expressed in UTC minutes of the week (0 being Monday 00:00
+    UTC) for the given offset of the timezone of the windows.
+
+    :param rows: list of (weekday, start hour, end hour) of the windows
+    :param utc_offset: offset of the timezone in minutes
+    :return: tuple of the sorted starts and of the ends of the intervals
+    """
+    intervals = []
+    for weekday, start_hour, end_hour in rows:
+        start = (weekday * DAY_MINUTES + start_hour * 60 - utc_offset) % WEEK_MINUTES
+        end = start + (end_hour - start_hour) * 60
+        if end > WEEK_MINUTES:
+            intervals.append((0, end - WEEK_MINUTES))
+            end = WEEK_MINUTES
+        intervals.append((start, end))
+    starts, ends = [], []
+    for start, end in sorted(intervals):
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return tuple(starts), tuple(ends)
+
+
+def next_in_table(table, date_time):
+    """Return the earliest datetime at or after the datetime in the intervals
+    of the weekly table, None if the table is empty"""
+    starts, ends = table
+    if not starts:
+        return None
+    minute = week_minute(date_time)
+    index = bisect_right(starts, minute) - 1
+    if index >= 0 and minute < ends[index]:
+        return date_time
+    if index + 1 < len(starts):
+        next_start = starts[index + 1]
+    else:
+        next_start = starts[0] + WEEK_MINUTES
+    return date_time + timedelta(minutes=next_start - minute)
 
 
 class ResPartner(models.Model):
@@ -36,6 +102,13 @@ class ResPartner(models.Model):
         "partner.delivery.time.window", "partner_id", string="Delivery time windows"
     )
 
+    delivery_closure_calendar_id = fields.Many2one(
+        "resource.calendar",
+        string="Delivery closing days",
+        help="Deliveries are postponed after the global leaves of this "
+        "calendar, such as public holidays.",
+    )
+
     @api.constrains("delivery_time_preference", "delivery_time_window_ids")
     def _check_delivery_time_preference(self):
         for partner in self:
@@ -57,20 +130,397 @@ class ResPartner(models.Model):
         :param day: The day name (see time.weekday, ex: 0,1,2,...)
         :return: dict partner_id: delivery_window recordset
         """
+        window_model = self.env["partner.delivery.time.window"]
+        return {
+            partner_id: window_model.browse(window_ids)
+            for partner_id, window_ids in self.get_delivery_window_data(
+                day_name=day_name
+            ).items()
+        }
+
+    def get_delivery_window_data(self, day_name=None, with_times=False):
+        """
+        Return the delivery windows by partner id for the given day, as plain
+        data read at once
+
+        :param day: The day name (see time.weekday, ex: 0,1,2,...)
+        :param with_times: return the start and end times of the windows
+        :return: dict partner_id: list of delivery window ids, or of dicts
+            with the keys id, start and end (datetime.time) if with_times
+        """
         res = {}
         domain = [("partner_id", "in", self.ids)]
         if day_name is not None:
             week_day_id = self.env["time.weekday"]._get_id_by_name(day_name)
             domain.append(("time_window_weekday_ids", "in", week_day_id))
         windows = self.env["partner.delivery.time.window"].search(domain)
-        for window in windows:
-            if not res.get(window.partner_id.id):
-                res[window.partner_id.id] = self.env[
-                    "partner.delivery.time.window"
-                ].browse()
-            res[window.partner_id.id] |= window
+        fnames = ["partner_id"]
+        if with_times:
+            fnames += ["time_window_start", "time_window_end"]
+        for values in windows.read(fnames, load=None):
+            window_data = values["id"]
+            if with_times:
+                # the times are converted from the values read in the cache
+                window = windows.browse(values["id"])
+                window_data = {
+                    "id": window.id,
+                    "start": window.get_time_window_start_time(),
+                    "end": window.get_time_window_end_time(),
+                }
+            res.setdefault(values["partner_id"], []).append(window_data)
         return res
 
+    def _get_delivery_window_rows(self):
+        """Load with one query the delivery windows of the partners
+
+        :return: dict partner_id: list of (weekday, start hour, end hour)
+        """
+        rows = {partner.id: [] for partner in self}
+        if not self.ids:
+            return rows
+        window_model = self.env["partner.delivery.time.window"]
+        window_model.flush(
+            [
+                "partner_id",
+                "time_window_start",
+                "time_window_end",
+                "time_window_weekday_ids",
+            ]
+        )
+        self.env["time.weekday"].flush(["name"])
+        weekdays = window_model._fields["time_window_weekday_ids"]
+        self.env.cr.execute(
+            """
+            SELECT tw.partner_id, wd.name, tw.time_window_start, tw.time_window_end
+            FROM partner_delivery_time_window tw
+            JOIN {rel} rel ON rel.{window} = tw.id
+            JOIN time_weekday wd ON wd.id = rel.{weekday}
+            WHERE tw.partner_id IN %s
+            """.format(
+                rel=weekdays.relation,
+                window=weekdays.column1,
+                weekday=weekdays.column2,
+            ),
+            (tuple(self.ids),),
+        )
+        for partner_id, weekday, start, end in self.env.cr.fetchall():
+            rows[partner_id].append((int(weekday), start, end))
+        return rows
+
+    @api.model
+    def _get_transaction_versions(self, name):
+        """Return the dict `name` of the versions read or modified in the
+        transaction. They're dropped when it ends, as other transactions can
+        then be seen."""
+        cache = self.env.cr.cache
+        if VERSIONS not in cache:
+            cache[VERSIONS] = {}
+            for event in ("commit", "rollback"):
+                self.env.cr.after(event, partial(cache.pop, VERSIONS, None))
+        return cache[VERSIONS].setdefault(name, {})
+
+    def _get_delivery_window_versions(self):
+        """Return the version of the delivery windows of each partner, used
+        to key their cached tables
+
+        The version changes when a window of the partner is created, modified
+        or deleted, in this transaction or in a committed one, so the caches
+        of the other partners and of the other workers are kept. The windows
+        of a partner are only read once per transaction to get it.
+
+        :return: dict partner_id: version
+        """
+        stamps = self._get_transaction_versions("window_stamps")
+        missing_ids = [
+            partner_id for partner_id in self.ids if partner_id not in stamps
+        ]
+        if missing_ids:
+            self.env["partner.delivery.time.window"].flush(
+                ["partner_id", "write_date"]
+            )
+            self.env.cr.execute(
+                """
+                SELECT partner_id, COUNT(*), MAX(id), MAX(write_date)
+                FROM partner_delivery_time_window
+                WHERE partner_id IN %s
+                GROUP BY partner_id
+                """,
+                (tuple(missing_ids),),
+            )
+            found = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+            for partner_id in missing_ids:
+                stamps[partner_id] = found.get(partner_id)
+        modified = self._get_transaction_versions("window_modified")
+        return {
+            partner_id: (stamps[partner_id], modified.get(partner_id, 0))
+            for partner_id in self.ids
+        }
+
+    @api.model
+    def _bump_delivery_window_versions(self, partner_ids):
+        """Change the version of the delivery windows of the partners for the
+        rest of the transaction"""
+        modified = self._get_transaction_versions("window_modified")
+        for partner_id in partner_ids:
+            modified[partner_id] = modified.get(partner_id, 0) + 1
+
+    @api.model
+    @tools.ormcache("partner_id", "version", "utc_offset")
+    def _get_delivery_window_table(self, partner_id, version, utc_offset):
+        """Compile the delivery windows of a partner in a weekly table
+
+        The table is cached for the version of the windows of the partner,
+        see `_get_delivery_window_versions` and
+        `compile_delivery_window_table`.
+        """
+        rows = self.browse(partner_id)._get_delivery_window_rows()[partner_id]
+        return compile_delivery_window_table(rows, utc_offset)
+
+    def _get_delivery_window_table_getter(self):
+        """Return a function returning the cached weekly table of the partner
+        for an offset"""
+        self.ensure_one()
+        version = self._get_delivery_window_versions()[self.id]
+        return partial(self._get_delivery_window_table, self.id, version)
+
+    def _get_delivery_window_utc_offset(self, date_time):
+        """Return the offset in minutes of the timezone of the partner at the
+        given UTC datetime"""
+        self.ensure_one()
+        if not self.tz:
+            return 0
+        offset = pytz.utc.localize(date_time).astimezone(pytz.timezone(self.tz))
+        return int(offset.utcoffset().total_seconds() // 60)
+
+    def _get_next_delivery_window_datetime(self, date_time, get_table=None):
+        """Return the earliest UTC datetime at or after date_time in a
+        delivery window of the partner, None if the partner has no window
+
+        :param get_table: function returning the weekly table of the partner
+            for an offset, the cached table by default
+        """
+        self.ensure_one()
+        if get_table is None:
+            get_table = self._get_delivery_window_table_getter()
+        offset = self._get_delivery_window_utc_offset(date_time)
+        # The offset of the timezone may change until the next window
+        for __ in range(2):
+            next_date_time = next_in_table(get_table(offset), date_time)
+            if next_date_time is None:
+                return None
+            next_offset = self._get_delivery_window_utc_offset(next_date_time)
+            if next_offset == offset:
+                break
+            offset = next_offset
+        return next_date_time
+
+    @api.model
+    def _get_delivery_closure_leaves_domain(self, calendar):
+        """Domain of the global leaves closing deliveries for the calendar:
+        its own ones and the ones without calendar of its company, or of no
+        company"""
+        company_domain = [("calendar_id", "=", False)]
+        if calendar.company_id:
+            company_domain.append(
+                ("company_id", "in", [False, calendar.company_id.id])
+            )
+        return expression.AND(
+            [
+                [("resource_id", "=", False)],
+                expression.OR([[("calendar_id", "=", calendar.id)], company_domain]),
+            ]
+        )
+
+    @api.model
+    def _get_delivery_closure_versions(self, calendars):
+        """Return the version of the closing days of the calendars, used to
+        key the cached days
+
+        The version changes when a global leave of the calendar, or without
+        calendar of its company, is created, modified or deleted, in this
+        transaction or in a committed one. The leaves are only read once per
+        transaction, with two queries for all the calendars.
+
+        :return: dict calendar_id: version
+        """
+        stamps = self._get_transaction_versions("closure_stamps")
+        missing = calendars.filtered(lambda calendar: calendar.id not in stamps)
+        if missing:
+            self.env["resource.calendar.leaves"].flush(
+                ["calendar_id", "company_id", "resource_id", "write_date"]
+            )
+            self.env.cr.execute(
+                """
+                SELECT calendar_id, COUNT(*), MAX(id), MAX(write_date)
+                FROM resource_calendar_leaves
+                WHERE resource_id IS NULL AND calendar_id IN %s
+                GROUP BY calendar_id
+                """,
+                (tuple(missing.ids),),
+            )
+            calendar_stamps = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+            self.env.cr.execute(
+                """
+                SELECT company_id, COUNT(*), MAX(id), MAX(write_date)
+                FROM resource_calendar_leaves
+                WHERE resource_id IS NULL AND calendar_id IS NULL
+                GROUP BY company_id
+                """
+            )
+            company_stamps = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+            for calendar in missing:
+                if calendar.company_id:
+                    company_stamp = (
+                        company_stamps.get(None),
+                        company_stamps.get(calendar.company_id.id),
+                    )
+                else:
+                    company_stamp = tuple(
+                        sorted(company_stamps.items(), key=lambda x: x[0] or 0)
+                    )
+                stamps[calendar.id] = (calendar_stamps.get(calendar.id), company_stamp)
+        modified = self._get_transaction_versions("closure_modified")
+        return {
+            calendar.id: (
+                stamps[calendar.id],
+                modified.get(calendar.id, 0),
+                modified.get(False, 0),
+            )
+            for calendar in calendars
+        }
+
+    @api.model
+    def _bump_delivery_closure_versions(self, calendar_ids):
+        """Change the version of the closing days of the calendars for the
+        rest of the transaction, False standing for the leaves without
+        calendar"""
+        modified = self._get_transaction_versions("closure_modified")
+        for calendar_id in calendar_ids:
+            modified[calendar_id] = modified.get(calendar_id, 0) + 1
+
+    @api.model
+    @tools.ormcache("calendar_id", "version", "tz", "year")
+    def _get_delivery_closed_days(self, calendar_id, version, tz, year):
+        """Return the days off of a calendar during a year
+
+        The days are the local dates, in the timezone of the calendar, of its
+        global leaves (such as public holidays) and of the global leaves of
+        its company without calendar. They are cached for the version of the
+        leaves, see `_get_delivery_closure_versions`.
+
+        :return: frozenset of dates
+        """
+        tz = pytz.timezone(tz or "UTC")
+
+        def to_utc(date_time):
+            return tz.localize(date_time).astimezone(pytz.utc).replace(tzinfo=None)
+
+        def to_local(date_time):
+            return pytz.utc.localize(date_time).astimezone(tz).replace(tzinfo=None)
+
+        calendar = self.env["resource.calendar"].sudo().browse(calendar_id)
+        leaves = (
+            self.env["resource.calendar.leaves"]
+            .sudo()
+            .search(
+                expression.AND(
+                    [
+                        self._get_delivery_closure_leaves_domain(calendar),
+                        [
+                            ("date_from", "<", to_utc(datetime(year + 1, 1, 1))),
+                            ("date_to", ">", to_utc(datetime(year, 1, 1))),
+                        ],
+                    ]
+                )
+            )
+        )
+        days = set()
+        for leave in leaves:
+            day = to_local(leave.date_from).date()
+            end = to_local(leave.date_to)
+            last_day = end.date()
+            if end.time() == time.min:
+                # a leave ending at midnight does not close the next day
+                last_day -= timedelta(days=1)
+            while day <= last_day:
+                if day.year == year:
+                    days.add(day)
+                day += timedelta(days=1)
+        return frozenset(days)
+
+    def _get_delivery_closed_days_getter(self):
+        """Return a function returning the cached closing days of the partner
+        for a year"""
+        self.ensure_one()
+        calendar = self.delivery_closure_calendar_id
+        version = self._get_delivery_closure_versions(calendar)[calendar.id]
+        return partial(
+            self._get_delivery_closed_days, calendar.id, version, calendar.tz
+        )
+
+    def _get_delivery_closure_end(self, date_time, get_closed_days=None):
+        """Return the UTC datetime at which the partner opens again, if the
+        UTC datetime is on one of its closing days, None otherwise
+
+        :param get_closed_days: function returning the closing days of the
+            partner for a year, the cached days by default
+        """
+        self.ensure_one()
+        calendar = self.delivery_closure_calendar_id
+        if not calendar:
+            return None
+        if get_closed_days is None:
+            get_closed_days = self._get_delivery_closed_days_getter()
+        tz = pytz.timezone(calendar.tz or "UTC")
+        day = pytz.utc.localize(date_time).astimezone(tz).date()
+        closed = False
+        while day in get_closed_days(day.year):
+            closed = True
+            day += timedelta(days=1)
+        if not closed:
+            return None
+        open_date_time = tz.localize(datetime.combine(day, time.min))
+        return open_date_time.astimezone(pytz.utc).replace(tzinfo=None)
+
+    def _get_next_delivery_datetime(
+        self, date_time, get_table=None, get_closed_days=None
+    ):
+        """Return the earliest UTC datetime at or after date_time matching
+        the delivery time preference of the partner, out of its closing
+        days"""
+        self.ensure_one()
+        if get_table is None and self.delivery_time_preference == "time_windows":
+            get_table = self._get_delivery_window_table_getter()
+        if get_closed_days is None and self.delivery_closure_calendar_id:
+            get_closed_days = self._get_delivery_closed_days_getter()
+        for __ in range(MAX_CLOSURES):
+            date_time = self._get_next_preferred_delivery_datetime(
+                date_time, get_table=get_table
+            )
+            closure_end = self._get_delivery_closure_end(
+                date_time, get_closed_days=get_closed_days
+            )
+            if not closure_end:
+                break
+            date_time = closure_end
+        return date_time
+
+    def _get_next_preferred_delivery_datetime(self, date_time, get_table=None):
+        """Return the earliest UTC datetime at or after date_time matching
+        the delivery time preference of the partner"""
+        self.ensure_one()
+        if self.delivery_time_preference == "workdays":
+            if date_time.weekday() > 4:
+                next_monday = date_time.date() + timedelta(days=7 - date_time.weekday())
+                return datetime.combine(next_monday, time.min)
+            return date_time
+        if self.delivery_time_preference == "time_windows":
+            next_date_time = self._get_next_delivery_window_datetime(
+                date_time, get_table=get_table
+            )
+            return next_date_time or date_time
+        return date_time
+
     def is_in_delivery_window(self, date_time):
         """
         Checks if provided date_time is in a delivery window for actual partner
@@ -79,29 +529,54 @@ class ResPartner(models.Model):
         :return: Boolean
         """
         self.ensure_one()
+        if self._get_delivery_closure_end(date_time):
+            return False
         if self.delivery_time_preference == "workdays":
             if date_time.weekday() > 4:
                 return False
             return True
-        windows = self.get_delivery_windows(date_time.weekday()).get(self.id)
-        if windows:
-            for w in windows:
-                start_time = w.get_time_window_start_time()
-                end_time = w.get_time_window_end_time()
-                if self.tz:
-                    utc_start = tz_utils.tz_to_utc_time(self.tz, start_time)
-                    utc_end = tz_utils.tz_to_utc_time(self.tz, end_time)
-                else:
-                    utc_start = start_time
-                    utc_end = end_time
-                if utc_start <= date_time.time() < utc_end:
-                    return True
-        return False
+        get_table = self._get_delivery_window_table_getter()
+        table = get_table(self._get_delivery_window_utc_offset(date_time))
+        return next_in_table(table, date_time) == date_time
 
     def _get_delivery_time_format_string(self):
         return _("From %s to %s")
 
     def get_delivery_time_description(self):
+        """Return the description of the delivery time preference by partner id
+
+        The descriptions are cached by language and by the preference of the
+        partner, read on each call: for partners with time windows by version
+        of their windows, and shared by all the partners for the other
+        preferences.
+        """
+        lang = self.env.context.get("lang")
+        versions = self.filtered(
+            lambda p: p.delivery_time_preference == "time_windows"
+        )._get_delivery_window_versions()
+        res = {}
+        for partner in self:
+            preference = partner.delivery_time_preference
+            res[partner.id] = self._get_delivery_time_description_cached(
+                partner.id if preference == "time_windows" else False,
+                versions.get(partner.id),
+                preference,
+                lang,
+            )
+        return res
+
+    @api.model
+    @tools.ormcache("partner_id", "version", "preference", "lang")
+    def _get_delivery_time_description_cached(
+        self, partner_id, version, preference, lang
+    ):
+        partner = self.with_context(lang=lang).browse(partner_id)
+        if not partner:
+            # the description does not depend on the partner
+            partner = partner.new({"delivery_time_preference": preference})
+        return partner._get_delivery_time_description()[partner.id]
+
+    def _get_delivery_time_description(self):
         res = dict()
         day_translated_values = dict(
             self.env["time.weekday"]._fields["name"]._description_selection(self.env)
@@ -0,0 +1,52 @@
+# Copyright 2020 Camptocamp SA
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl)
+
+from odoo import api, models
+
+
+class ResourceCalendarLeaves(models.Model):
+
+    _inherit = "resource.calendar.leaves"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._bump_delivery_closure_versions()
+        return records
+
+    def write(self, vals):
+        self._bump_delivery_closure_versions()
+        res = super().write(vals)
+        self._bump_delivery_closure_versions()
+        return res
+
+    def unlink(self):
+        self._bump_delivery_closure_versions()
+        return super().unlink()
+
+    def _bump_delivery_closure_versions(self):
+        """Change the version of the closing days of the partners for the
+        global leaves of the delivery closing days calendars, or without
+        calendar. The other leaves, such as time off, are left out."""
+        leaves = self.filtered(lambda leave: not leave.resource_id)
+        if not leaves:
+            return
+        calendar_ids = set(leaves.calendar_id.ids)
+        if calendar_ids:
+            used_calendars = (
+                self.env["res.partner"]
+                .sudo()
+                .with_context(active_test=False)
+                .read_group(
+                    [("delivery_closure_calendar_id", "in", list(calendar_ids))],
+                    ["delivery_closure_calendar_id"],
+                    ["delivery_closure_calendar_id"],
+                )
+            )
+            calendar_ids = {
+                group["delivery_closure_calendar_id"][0] for group in used_calendars
+            }
+        if any(not leave.calendar_id for leave in leaves):
+            calendar_ids.add(False)
+        if calendar_ids:
+            self.env["res.partner"]._bump_delivery_closure_versions(calendar_ids)
@@ -1,8 +1,12 @@
 # Copyright 2020 Camptocamp SA
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl)
+from functools import partial
+
 from odoo import _, api, models
 from odoo.tools.misc import format_datetime
 
+from .res_partner import compile_delivery_window_table
+
 
 class StockPicking(models.Model):
     _inherit = "stock.picking"
@@ -10,6 +14,59 @@ class StockPicking(models.Model):
     def _planned_delivery_date(self):
         return self.scheduled_date
 
+    def get_next_delivery_datetimes(self, from_datetime=None):
+        """Return the earliest delivery datetime allowed by the partner of
+        each transfer
+
+        The delivery windows of all the partners, and the versions of their
+        closing days, are loaded at once.
+
+        :param from_datetime: UTC datetime from which the delivery datetimes
+            are searched, the planned delivery date of each transfer if not set
+        :return: dict picking_id: UTC datetime
+        """
+        partners = self.partner_id.filtered(
+            lambda p: p.delivery_time_preference == "time_windows"
+        )
+        rows = partners._get_delivery_window_rows()
+        tables = {}
+        calendars = self.partner_id.delivery_closure_calendar_id
+        closure_versions = self.env["res.partner"]._get_delivery_closure_versions(
+            calendars
+        )
+        closed_days = {}
+
+        def get_table(partner_id, utc_offset):
+            key = (partner_id, utc_offset)
+            if key not in tables:
+                tables[key] = compile_delivery_window_table(
+                    rows[partner_id], utc_offset
+                )
+            return tables[key]
+
+        def get_closed_days(calendar, year):
+            key = (calendar.id, year)
+            if key not in closed_days:
+                closed_days[key] = self.env["res.partner"]._get_delivery_closed_days(
+                    calendar.id, closure_versions[calendar.id], calendar.tz, year
+                )
+            return closed_days[key]
+
+        res = {}
+        for picking in self:
+            date_time = from_datetime or picking._planned_delivery_date()
+            partner = picking.partner_id
+            if partner:
+                date_time = partner._get_next_delivery_datetime(
+                    date_time,
+                    get_table=partial(get_table, partner.id),
+                    get_closed_days=partial(
+                        get_closed_days, partner.delivery_closure_calendar_id
+                    ),
+                )
+            res[picking.id] = date_time
+        return res
+
     @api.onchange("scheduled_date")
     def _onchange_scheduled_date(self):
         self.ensure_one()
@@ -1,5 +1,7 @@
 # Copyright 2020 Camptocamp
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from datetime import date, datetime
+
 from freezegun import freeze_time
 
 from odoo.tests import SavepointCase
@@ -168,3 +170,224 @@ class TestPartnerDeliveryWindow(SavepointCase):
         self.assertEqual(len(copied_partner.delivery_time_window_ids), expecting)
         copied_partner = self.customer_working_days.copy()
         self.assertFalse(copied_partner.delivery_time_window_ids)
+
+    @freeze_time("2020-04-02 07:59:59")  # Thursday
+    def test_next_delivery_window_datetime(self):
+        partner = self.customer_time_window
+        partner.tz = "Europe/Brussels"
+        partner.delivery_time_window_ids.write(
+            {"time_window_start": 10.0, "time_window_end": 16.0}
+        )
+        # Brussels is UTC+2 in April
+        self.assertEqual(
+            partner._get_next_delivery_window_datetime(datetime(2020, 4, 2, 7, 0)),
+            datetime(2020, 4, 2, 8, 0),
+        )
+        self.assertEqual(
+            partner._get_next_delivery_window_datetime(datetime(2020, 4, 2, 9, 0)),
+            datetime(2020, 4, 2, 9, 0),
+        )
+        # After the window on Thursday, the next one is on Saturday
+        self.assertEqual(
+            partner._get_next_delivery_window_datetime(datetime(2020, 4, 2, 14, 0)),
+            datetime(2020, 4, 4, 8, 0),
+        )
+        # After the window on Saturday, the next one is on Thursday
+        self.assertEqual(
+            partner._get_next_delivery_window_datetime(datetime(2020, 4, 4, 14, 0)),
+            datetime(2020, 4, 9, 8, 0),
+        )
+        # Brussels is UTC+1 in March, before the DST change of 2020-03-29
+        self.assertEqual(
+            partner._get_next_delivery_window_datetime(datetime(2020, 3, 26, 7, 0)),
+            datetime(2020, 3, 26, 9, 0),
+        )
+        self.assertEqual(
+            partner._get_next_delivery_window_datetime(datetime(2020, 3, 28, 18, 0)),
+            datetime(2020, 4, 2, 8, 0),
+        )
+        self.assertIsNone(
+            self.customer_anytime._get_next_delivery_window_datetime(
+                datetime(2020, 4, 2, 7, 0)
+            )
+        )
+
+    def test_delivery_window_across_midnight_utc(self):
+        partner = self.customer_time_window
+        partner.tz = "Europe/Brussels"
+        # 00:30 to 10:00 on Thursday in Brussels starts on Wednesday in UTC
+        partner.delivery_time_window_ids.write(
+            {"time_window_start": 0.5, "time_window_end": 10.0}
+        )
+        self.assertTrue(partner.is_in_delivery_window(datetime(2020, 4, 1, 22, 30)))
+        self.assertFalse(partner.is_in_delivery_window(datetime(2020, 4, 1, 22, 29)))
+        self.assertTrue(partner.is_in_delivery_window(datetime(2020, 4, 2, 7, 59)))
+        self.assertFalse(partner.is_in_delivery_window(datetime(2020, 4, 2, 8, 0)))
+        # The compiled table follows the changes of the windows
+        partner.delivery_time_window_ids.write({"time_window_end": 11.0})
+        self.assertTrue(partner.is_in_delivery_window(datetime(2020, 4, 2, 8, 0)))
+
+    def test_delivery_window_versions(self):
+        partner = self.customer_time_window
+        other_partner = partner.copy()
+        partners = partner | other_partner
+        versions = partners._get_delivery_window_versions()
+        # The versions are read once per transaction
+        with self.assertQueryCount(0):
+            self.assertEqual(partners._get_delivery_window_versions(), versions)
+        # Only the version of the partner of the modified window changes
+        partner.delivery_time_window_ids.write({"time_window_end": 20.0})
+        new_versions = partners._get_delivery_window_versions()
+        self.assertNotEqual(new_versions[partner.id], versions[partner.id])
+        self.assertEqual(new_versions[other_partner.id], versions[other_partner.id])
+        partner.delivery_time_preference = "anytime"
+        partner.delivery_time_window_ids.unlink()
+        self.assertNotEqual(
+            partners._get_delivery_window_versions()[partner.id],
+            new_versions[partner.id],
+        )
+
+    def test_get_next_delivery_datetimes(self):
+        self.customer_time_window.tz = "Europe/Brussels"
+        self.customer_time_window.delivery_time_window_ids.write(
+            {"time_window_start": 10.0, "time_window_end": 16.0}
+        )
+        anytime_picking = self._create_delivery_picking(self.customer_anytime)
+        workdays_picking = self._create_delivery_picking(self.customer_working_days)
+        time_window_picking = self._create_delivery_picking(self.customer_time_window)
+        pickings = anytime_picking | workdays_picking | time_window_picking
+        # Friday
+        res = pickings.get_next_delivery_datetimes(datetime(2020, 4, 3, 12, 0))
+        self.assertEqual(res[anytime_picking.id], datetime(2020, 4, 3, 12, 0))
+        self.assertEqual(res[workdays_picking.id], datetime(2020, 4, 3, 12, 0))
+        self.assertEqual(res[time_window_picking.id], datetime(2020, 4, 4, 8, 0))
+        # Saturday, from the scheduled date of the transfers
+        pickings.write({"scheduled_date": datetime(2020, 4, 4, 12, 0)})
+        res = pickings.get_next_delivery_datetimes()
+        self.assertEqual(res[anytime_picking.id], datetime(2020, 4, 4, 12, 0))
+        self.assertEqual(res[workdays_picking.id], datetime(2020, 4, 6, 0, 0))
+        self.assertEqual(res[time_window_picking.id], datetime(2020, 4, 4, 12, 0))
+
+    def test_get_delivery_window_data(self):
+        partner = self.customer_time_window
+        window = partner.delivery_time_window_ids
+        partners = partner | self.customer_anytime
+        self.assertEqual(partners.get_delivery_window_data(), {partner.id: window.ids})
+        self.assertEqual(partners.get_delivery_windows(), {partner.id: window})
+        # Thursday
+        self.assertEqual(
+            partners.get_delivery_window_data(day_name=3, with_times=True),
+            {
+                partner.id: [
+                    {
+                        "id": window.id,
+                        "start": window.get_time_window_start_time(),
+                        "end": window.get_time_window_end_time(),
+                    }
+                ]
+            },
+        )
+        # Friday
+        self.assertEqual(partners.get_delivery_window_data(day_name=4), {})
+
+    def test_delivery_time_description_cache(self):
+        partner = self.customer_time_window.with_context(lang="en_US")
+        description = partner.get_delivery_time_description()[partner.id]
+        self.assertIn("Thursday", description)
+        self.assertNotIn("Monday", description)
+        self.assertIs(partner.get_delivery_time_description()[partner.id], description)
+        partner.delivery_time_window_ids.time_window_weekday_ids |= self.env.ref(
+            "base_time_window.time_weekday_monday"
+        )
+        self.assertIn("Monday", partner.get_delivery_time_description()[partner.id])
+        # Partners without time windows share the same description
+        partners = (self.customer_working_days | self.customer_anytime).with_context(
+            lang="en_US"
+        )
+        descriptions = partners.get_delivery_time_description()
+        self.assertIn("Monday", descriptions[self.customer_working_days.id])
+        self.assertNotIn("Sunday", descriptions[self.customer_working_days.id])
+        self.assertIn("Sunday", descriptions[self.customer_anytime.id])
+        partner.delivery_time_preference = "anytime"
+        self.assertEqual(
+            partner.get_delivery_time_description()[partner.id],
+            descriptions[self.customer_anytime.id],
+        )
+
+    def test_delivery_closing_days(self):
+        calendar = self.env["resource.calendar"].create(
+            {"name": "Closing days", "tz": "UTC"}
+        )
+        self.env["resource.calendar.leaves"].create(
+            {
+                "name": "Holiday",
+                "calendar_id": calendar.id,
+                "date_from": datetime(2020, 4, 3, 0, 0),
+                "date_to": datetime(2020, 4, 4, 0, 0),
+            }
+        )
+        partners = self.customer_working_days | self.customer_time_window
+        partners.write({"delivery_closure_calendar_id": calendar.id})
+        partner_model = self.env["res.partner"]
+        version = partner_model._get_delivery_closure_versions(calendar)[calendar.id]
+        self.assertEqual(
+            partner_model._get_delivery_closed_days(calendar.id, version, "UTC", 2020),
+            frozenset([date(2020, 4, 3)]),
+        )
+        # The leaves of resources, such as time off, don't change the version
+        self.env["resource.calendar.leaves"].create(
+            {
+                "name": "Time off",
+                "calendar_id": calendar.id,
+                "resource_id": self.env["resource.resource"]
+                .create({"name": "Resource", "calendar_id": calendar.id})
+                .id,
+                "date_from": datetime(2020, 4, 6, 0, 0),
+                "date_to": datetime(2020, 4, 7, 0, 0),
+            }
+        )
+        with self.assertQueryCount(0):
+            self.assertEqual(
+                partner_model._get_delivery_closure_versions(calendar),
+                {calendar.id: version},
+            )
+        # Thursday
+        self.assertTrue(
+            self.customer_working_days.is_in_delivery_window(datetime(2020, 4, 2, 12))
+        )
+        # Friday is closed
+        self.assertFalse(
+            self.customer_working_days.is_in_delivery_window(datetime(2020, 4, 3, 12))
+        )
+        # the next working day is Monday
+        self.assertEqual(
+            self.customer_working_days._get_next_delivery_datetime(
+                datetime(2020, 4, 3, 12)
+            ),
+            datetime(2020, 4, 6, 0, 0),
+        )
+        # Saturday is closed too, the next window is on Thursday
+        self.env["resource.calendar.leaves"].create(
+            {
+                "name": "Holiday",
+                "calendar_id": calendar.id,
+                "date_from": datetime(2020, 4, 4, 0, 0),
+                "date_to": datetime(2020, 4, 4, 23, 59),
+            }
+        )
+        self.assertFalse(
+            self.customer_time_window.is_in_delivery_window(datetime(2020, 4, 4, 12))
+        )
+        picking = self._create_delivery_picking(self.customer_time_window)
+        res = picking.get_next_delivery_datetimes(datetime(2020, 4, 3, 12))
+        self.assertEqual(res[picking.id], datetime(2020, 4, 9, 0, 0))
+        # The global leaves of the company without calendar close it too
+        self.env["resource.calendar.leaves"].create(
+            {
+                "name": "Company holiday",
+                "date_from": datetime(2020, 4, 9, 0, 0),
+                "date_to": datetime(2020, 4, 10, 0, 0),
+            }
+        )
+        res = picking.get_next_delivery_datetimes(datetime(2020, 4, 3, 12))
+        self.assertEqual(res[picking.id], datetime(2020, 4, 11, 0, 0))
@@ -4,7 +4,7 @@
 {
     "name": "Stock Picking: group by partner and carrier",
     "Summary": "Group sales deliveries moves in 1 picking per partner and carrier",
-    "version": "14.0.1.4.2",
+    "version": "14.0.1.5.0",
     "development_status": "Alpha",
     "author": "Camptocamp, BCIM, Odoo Community Association (OCA)",
     "website": "https://github.com/OCA/stock-logistics-workflow",
@@ -14,6 +14,7 @@
         "stock_move_assign_picking_hook",
     ],
     "data": [
+        "data/ir_cron.xml",
         "views/res_partner.xml",
         "views/stock_picking_type.xml",
         "views/stock_warehouse.xml",
@@ -10,3 +10,20 @@ class ProcurementGroup(models.Model):
         inverse_name="group_id",
         readonly=True,
     )
+
+    def write(self, vals):
+        if "sale_ids" not in vals:
+            return super().write(vals)
+        old_sales = {group.id: group.sale_ids for group in self}
+        res = super().write(vals)
+        moves = self.env["stock.move"].search(
+            [("group_id", "in", self.ids), ("picking_id", "!=", False)]
+        )
+        removed = self.filtered(lambda group: old_sales[group.id] - group.sale_ids)
+        moves.filtered(
+            lambda move: move.group_id in removed
+        ).picking_id._sync_sale_ids()
+        moves.filtered(
+            lambda move: move.group_id not in removed
+        )._add_picking_sale_ids()
+        return res
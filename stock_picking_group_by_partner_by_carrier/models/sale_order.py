@@ -7,13 +7,12 @@ class SaleOrder(models.Model):
     picking_ids = fields.Many2many("stock.picking", string="Transfers", copy=False)
 
     def action_cancel(self):
-        for sale_order in self:
-            # change the context so we can intercept this in StockPicking.action_cancel
-            proc_groups = sale_order.order_line._get_procurement_group()
-            super(
-                SaleOrder,
-                sale_order.with_context(cancel_sale_group_ids=proc_groups.ids),
-            ).action_cancel()
+        # change the context so we can intercept this in StockPicking.action_cancel
+        # where the moves of all the orders are canceled at once
+        proc_groups = self.order_line._get_procurement_group()
+        return super(
+            SaleOrder, self.with_context(cancel_sale_group_ids=proc_groups.ids)
+        ).action_cancel()
 
     def get_name_for_delivery_line(self):
         """Get the name for the sale order displayed on the delivery note"""
@@ -6,6 +6,16 @@ from collections import namedtuple
 from itertools import groupby
 
 from odoo import api, fields, models
+from odoo.osv import expression
+
+# keys of the assignation cache and of the moves whose procurement groups are
+# to be merged once assigned in the cursor cache
+ASSIGNATION_CACHE = "stock_picking_group_by_partner_by_carrier.assignation"
+ASSIGNATION_MERGE = "stock_picking_group_by_partner_by_carrier.assignation_merge"
+# key of the origin links to post once the moves are assigned, when deferred
+ASSIGNATION_ORIGIN_LINKS = (
+    "stock_picking_group_by_partner_by_carrier.assignation_origin_links"
+)
 
 
 class StockMove(models.Model):
@@ -27,28 +37,187 @@ class StockMove(models.Model):
         # merged.
         return super()._prepare_merge_moves_distinct_fields() + ["original_group_id"]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        moves = super().create(vals_list)
+        moves._add_picking_sale_ids()
+        return moves
+
+    def write(self, vals):
+        sync_sale_ids = "picking_id" in vals or "group_id" in vals
+        if sync_sale_ids:
+            pickings = self.picking_id
+        res = super().write(vals)
+        if sync_sale_ids:
+            if "group_id" in vals:
+                # Sales may have been removed from the transfers
+                (pickings | self.picking_id)._sync_sale_ids()
+            else:
+                (pickings - self.picking_id)._sync_sale_ids()
+                self._add_picking_sale_ids()
+        return res
+
+    def unlink(self):
+        pickings = self.picking_id
+        res = super().unlink()
+        pickings.exists()._sync_sale_ids()
+        return res
+
+    def _add_picking_sale_ids(self):
+        """Add the sales of the procurement groups of the moves to their
+        transfers"""
+        moves = self.filtered(lambda move: move.picking_id and move.group_id)
+        for picking, pmoves in groupby(
+            moves.sorted(lambda m: m.picking_id.id), key=lambda m: m.picking_id
+        ):
+            picking._add_sale_ids(self.browse(m.id for m in pmoves).group_id.sale_ids)
+
     def _assign_picking(self):
-        result = super(
-            StockMove, self.with_context(picking_no_overwrite_partner_origin=1)
-        )._assign_picking()
+        # The pickings found for each assignation domain are cached for the
+        # whole call, prefilled with a single search for all the moves.
+        # The procurement groups of all the transfers are merged at once
+        # at the end.
+        cache = self.env.cr.cache
+        cache_owner = ASSIGNATION_CACHE not in cache
+        if cache_owner:
+            cache[ASSIGNATION_CACHE] = self._prefetch_picking_for_assignation()
+            cache[ASSIGNATION_MERGE] = []
+            if self._defer_origin_link_message():
+                cache[ASSIGNATION_ORIGIN_LINKS] = {}
+        moves = self.with_context(picking_no_overwrite_partner_origin=1)
+        try:
+            result = super(StockMove, moves)._assign_picking()
+            if cache_owner:
+                moves = moves.browse(cache[ASSIGNATION_MERGE])
+                # Assignations done while merging are not deferred anymore
+                del cache[ASSIGNATION_MERGE]
+                moves._merge_assigned_procurement_groups()
+                origin_links = cache.pop(ASSIGNATION_ORIGIN_LINKS, None)
+                if origin_links:
+                    self.env["stock.picking"]._post_origin_links(origin_links)
+        finally:
+            if cache_owner:
+                del cache[ASSIGNATION_CACHE]
+                cache.pop(ASSIGNATION_MERGE, None)
+                cache.pop(ASSIGNATION_ORIGIN_LINKS, None)
         return result
 
+    @api.model
+    def _defer_origin_link_message(self):
+        """Whether the messages linking the transfers to the sales are posted
+        at once at the end of the assignation"""
+        return bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(
+                "stock_picking_group_by_partner_by_carrier.defer_origin_link_message"
+            )
+        )
+
+    @api.model
+    def _assignation_cache_key(self, domain):
+        return tuple(
+            tuple(tuple(x) if isinstance(x, list) else x for x in leaf)
+            if isinstance(leaf, (list, tuple))
+            else leaf
+            for leaf in domain
+        )
+
+    def _prefetch_picking_for_assignation(self):
+        """Search at once the pickings the moves can be assigned to.
+
+        :returns: a dict with the picking found by assignation domain
+        """
+        domains = {}
+        for move in self:
+            if move.picking_id:
+                continue
+            domain = move._domain_search_picking_for_assignation()
+            domains.setdefault(self._assignation_cache_key(domain), domain)
+        if not domains:
+            return {}
+        pickings = self.env["stock.picking"].search(
+            expression.OR(list(domains.values()))
+        )
+        return {
+            key: pickings.filtered_domain(domain)[:1] for key, domain in domains.items()
+        }
+
+    def _search_picking_for_assignation(self):
+        assignation_cache = self.env.cr.cache.get(ASSIGNATION_CACHE)
+        if assignation_cache is None:
+            return super()._search_picking_for_assignation()
+        domain = self._domain_search_picking_for_assignation()
+        key = self._assignation_cache_key(domain)
+        picking = assignation_cache.get(key)
+        # The picking may have changed since it was cached
+        if picking is None or (picking and not picking.filtered_domain(domain)):
+            picking = super()._search_picking_for_assignation()
+            assignation_cache[key] = picking
+        return picking.with_env(self.env)
+
+    def _update_assignation_cache(self, picking):
+        """A new picking has been created for the moves: it's the one to use
+        for their domain, and it may suit the domains no picking was found
+        for"""
+        assignation_cache = self.env.cr.cache.get(ASSIGNATION_CACHE)
+        if assignation_cache is None:
+            return
+        for key in [k for k, v in assignation_cache.items() if not v]:
+            del assignation_cache[key]
+        domain = self[0]._domain_search_picking_for_assignation()
+        if picking.filtered_domain(domain):
+            assignation_cache[self._assignation_cache_key(domain)] = picking
+
     def _assign_picking_post_process(self, new=False):
+        if new:
+            self._update_assignation_cache(self.picking_id)
+        moves_to_merge = self.env.cr.cache.get(ASSIGNATION_MERGE)
+        # The moves of "deliver all at once" sales still search their transfer
+        # on the procurement group: their groups are merged right away so
+        # the next moves of the call find them
+        eager_merge = any(
+            move.group_id.sale_id.picking_policy == "one" for move in self
+        )
+        if moves_to_merge is not None and not eager_merge:
+            moves_to_merge.extend(self.ids)
+        else:
+            self._merge_assigned_procurement_groups()
+        res = super()._assign_picking_post_process(new=new)
+        return res
+
+    def _merge_assigned_procurement_groups(self):
+        """Merge at once the procurement groups of the transfers the moves
+        have been assigned to"""
+        merged_picking_ids = set(self.picking_id._batch_merge_procurement_groups().ids)
         moves_by_picking = groupby(
             sorted(self, key=lambda m: m.picking_id.id), key=lambda m: m.picking_id
         )
+        merged_moves = self.browse()
         for picking, imoves in moves_by_picking:
-            merged = picking._merge_procurement_groups()
-            if merged:
+            if picking.id in merged_picking_ids:
                 moves = self.browse(m.id for m in imoves)
-                moves.picking_id._update_merged_origin()
                 moves._on_assign_picking_message_link()
-        res = super()._assign_picking_post_process(new=new)
-        return res
+                merged_moves |= moves
+        merged_moves.picking_id._add_merged_origins(
+            self.env["stock.picking"]._get_moves_origins_by_picking(merged_moves)
+        )
+
+    def _get_new_picking_values(self):
+        values = super()._get_new_picking_values()
+        # The origins of a new transfer are the ones of its first moves
+        values["merged_origins"] = "\n".join(
+            sorted(set(self.filtered("origin").mapped("origin")))
+        )
+        return values
 
     def _on_assign_picking_message_link(self):
         sales = self.sale_line_id.order_id
-        if sales:
+        origin_links = self.env.cr.cache.get(ASSIGNATION_ORIGIN_LINKS)
+        if sales and origin_links is not None:
+            for picking in self.picking_id:
+                origin_links.setdefault(picking.id, set()).update(sales.ids)
+        elif sales:
             self.picking_id.message_post_with_view(
                 "mail.message_origin_link",
                 values={"self": self.picking_id, "origin": sales, "edit": True},
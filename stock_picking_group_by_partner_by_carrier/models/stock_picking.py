@@ -2,18 +2,31 @@
 # Copyright 2020-2021 Jacques-Etienne Baudoux (BCIM) <je@bcim.be>
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 
+import logging
+from collections import Counter
 from itertools import groupby
 
-from odoo import api, fields, models
+from odoo import _, api, fields, models, tools
+from odoo.osv import expression
+
+_logger = logging.getLogger(__name__)
 
 
 class StockPicking(models.Model):
     _inherit = "stock.picking"
 
-    sale_ids = fields.Many2many("sale.order", compute="_compute_sale_ids", store=True)
+    # The sales of the procurement groups of the moves. Not computed to avoid
+    # recomputing all the transfers of a group each time it changes: it is
+    # maintained by the moves and the procurement groups (see
+    # `_add_sale_ids` and `_sync_sale_ids`)
+    sale_ids = fields.Many2many("sale.order", copy=False, readonly=True)
     # don't copy the printed state of a picking otherwise the backorder of a
     # printed picking becomes printed
     printed = fields.Boolean(copy=False)
+    # The origins of the moves of the transfer, one by line, maintained by
+    # delta on merges and cancellations to render the origin (see
+    # `_add_merged_origins` and `_remove_merged_origins`)
+    merged_origins = fields.Text(copy=False, readonly=True)
     canceled_by_merge = fields.Boolean(
         default=False,
         help="Technical field. Indicates the transfer is"
@@ -33,10 +46,94 @@ class StockPicking(models.Model):
             if not picking.move_lines:
                 picking.canceled_by_merge = True
 
-    @api.depends("move_lines.group_id.sale_ids")
-    def _compute_sale_ids(self):
-        for rec in self:
-            rec.sale_ids = rec.mapped("move_lines.group_id.sale_ids")
+    def _get_moves_sale_ids(self):
+        """Return the ids of the sales of the procurement groups of the moves,
+        by transfer id"""
+        sale_ids = {picking.id: set() for picking in self}
+        if not self.ids:
+            return sale_ids
+        self.env["stock.move"].flush(["picking_id", "group_id"])
+        self.env["procurement.group"].flush(["sale_ids"])
+        group_sales = self.env["procurement.group"]._fields["sale_ids"]
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT move.picking_id, rel.{sale}
+            FROM stock_move move
+            JOIN {rel} rel ON rel.{group} = move.group_id
+            WHERE move.picking_id IN %s
+            """.format(
+                rel=group_sales.relation,
+                group=group_sales.column1,
+                sale=group_sales.column2,
+            ),
+            (tuple(self.ids),),
+        )
+        for picking_id, sale_id in self.env.cr.fetchall():
+            sale_ids[picking_id].add(sale_id)
+        return sale_ids
+
+    def _add_sale_ids(self, sales):
+        """Link the sales to the transfers, without checking the moves"""
+        for picking in self:
+            missing = sales - picking.sale_ids
+            if missing:
+                picking.sale_ids = [(4, sale.id) for sale in missing]
+
+    def _sync_sale_ids(self):
+        """Set the sales of the transfers from the procurement groups of
+        their moves
+
+        :returns: the transfers whose sales were wrong
+        """
+        sale_ids = self._get_moves_sale_ids()
+        fixed = self.browse()
+        for picking in self:
+            if set(picking.sale_ids.ids) != sale_ids[picking.id]:
+                picking.sale_ids = [(6, 0, sorted(sale_ids[picking.id]))]
+                fixed |= picking
+        return fixed
+
+    @api.model
+    def _cron_check_sale_ids(self, chunk_size=1000):
+        """Check and fix the sales of all the transfers"""
+        group_sales = self.env["procurement.group"]._fields["sale_ids"]
+        picking_sales = self._fields["sale_ids"]
+        self.flush(["sale_ids"])
+        self.env["stock.move"].flush(["picking_id", "group_id"])
+        self.env["procurement.group"].flush(["sale_ids"])
+        self.env.cr.execute(
+            """
+            WITH expected AS (
+                SELECT DISTINCT move.picking_id, rel.{group_sale}
+                FROM stock_move move
+                JOIN {group_rel} rel ON rel.{group} = move.group_id
+                WHERE move.picking_id IS NOT NULL
+            ), actual AS (
+                SELECT {picking}, {picking_sale} FROM {picking_rel}
+            )
+            SELECT DISTINCT picking_id FROM (
+                (SELECT * FROM expected EXCEPT SELECT * FROM actual)
+                UNION ALL
+                (SELECT * FROM actual EXCEPT SELECT * FROM expected)
+            ) AS wrong (picking_id, sale_id)
+            """.format(
+                group_rel=group_sales.relation,
+                group=group_sales.column1,
+                group_sale=group_sales.column2,
+                picking_rel=picking_sales.relation,
+                picking=picking_sales.column1,
+                picking_sale=picking_sales.column2,
+            )
+        )
+        picking_ids = [row[0] for row in self.env.cr.fetchall()]
+        fixed = self.browse()
+        for ids in tools.split_every(chunk_size, picking_ids):
+            fixed |= self.browse(ids)._sync_sale_ids()
+        if fixed:
+            _logger.warning(
+                "Fixed the sales of %s transfers: %s", len(fixed), fixed.ids
+            )
+        return fixed
 
     def write(self, values):
         if self.env.context.get("picking_no_overwrite_partner_origin"):
@@ -50,16 +147,35 @@ class StockPicking(models.Model):
         # all moves of the picking
         cancel_sale_group_ids = self.env.context.get("cancel_sale_group_ids")
         if cancel_sale_group_ids:
-            moves = self.move_lines.filtered(
-                lambda m: m.original_group_id.id in cancel_sale_group_ids
-                and m.state not in ("done", "cancel")
+            self._cancel_procurement_group_moves(
+                self.env["procurement.group"].browse(cancel_sale_group_ids)
             )
-            moves.with_context(cancel_sale_group_ids=False)._action_cancel()
             return True
         else:
             return super().action_cancel()
 
+    def _cancel_procurement_group_moves(self, groups):
+        """Cancel at once the moves of the transfers originating from the
+        procurement groups, and remove their origins from the merged origin
+        of the transfers still having moves to do"""
+        moves = self.env["stock.move"].search(
+            [
+                ("picking_id", "in", self.ids),
+                ("original_group_id", "in", groups.ids),
+                ("state", "not in", ("done", "cancel")),
+            ]
+        )
+        moves.with_context(cancel_sale_group_ids=False)._action_cancel()
+        moves.picking_id.filtered(
+            lambda picking: picking.state != "cancel"
+            and picking.picking_type_id.code == "outgoing"
+            and not picking._is_grouping_disabled()
+        )._remove_merged_origins(self._get_moves_origins_by_picking(moves))
+        return moves
+
     def _create_backorder(self):
+        if self._use_pooled_backorder():
+            return self._create_backorder_pooled()
         backorders = self.browse()
         for picking in self:
             if not picking._is_grouping_disabled():
@@ -71,16 +187,259 @@ class StockPicking(models.Model):
             backorders |= backorder
         return backorders
 
+    @api.model
+    def _use_pooled_backorder(self):
+        return bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("stock_picking_group_by_partner_by_carrier.pooled_backorder")
+        )
+
+    def _create_backorder_pooled(self):
+        """Create the backorders of the transfers at once.
+
+        The moves left in the transfers are pooled by assignation domain
+        (partner, carrier, shipping policy...), the transfers they can be
+        added to are searched at once and the moves are moved with one write
+        per transfer. A new backorder is created only for the pools without
+        a transfer found.
+        """
+        grouping_disabled = self.filtered(lambda p: p._is_grouping_disabled())
+        backorders = super(StockPicking, grouping_disabled)._create_backorder()
+        pools = {}
+        for picking in self - grouping_disabled:
+            moves = picking.move_lines.filtered(
+                lambda m: m.state not in ("done", "cancel")
+            )
+            if not moves:
+                continue
+            domain = moves[0]._domain_search_picking_for_assignation()
+            pool = pools.setdefault(
+                moves._assignation_cache_key(domain),
+                {"domain": domain, "pickings": self.browse(), "moves": moves.browse()},
+            )
+            pool["pickings"] |= picking
+            pool["moves"] |= moves
+        if not pools:
+            return backorders
+        # The transfers being validated are not a target for their backorders
+        targets = self.search(
+            expression.AND(
+                [
+                    expression.OR([pool["domain"] for pool in pools.values()]),
+                    [("id", "not in", self.ids)],
+                ]
+            )
+        )
+        pooled_backorders = self.browse()
+        for pool in pools.values():
+            backorder = targets.filtered_domain(pool["domain"])[:1]
+            if not backorder:
+                picking = pool["pickings"][0]
+                backorder = picking.copy(
+                    {
+                        "name": "/",
+                        "move_lines": [],
+                        "move_line_ids": [],
+                        "backorder_id": picking.id,
+                    }
+                )
+            for picking in pool["pickings"]:
+                picking._post_backorder_message(backorder)
+            moves = pool["moves"]
+            moves.write({"picking_id": backorder.id})
+            moves.package_level_id.write({"picking_id": backorder.id})
+            moves.move_line_ids.write({"picking_id": backorder.id})
+            pooled_backorders |= backorder
+        pooled_backorders._batch_merge_procurement_groups()
+        pooled_backorders._update_merged_origin()
+        return backorders | pooled_backorders
+
+    def _post_backorder_message(self, backorder):
+        self.ensure_one()
+        self.message_post(
+            body=_(
+                "The backorder <a href=# data-oe-model=stock.picking "
+                "data-oe-id=%d>%s</a> has been created."
+            )
+            % (backorder.id, backorder.name)
+        )
+
+    def _get_merged_origins(self):
+        """Return the sorted origins of the moves not canceled, by transfer id.
+
+        The origins are aggregated in SQL so the moves of large transfers are
+        not loaded in the cache.
+        """
+        origins = {picking.id: [] for picking in self}
+        if not self.ids:
+            return origins
+        self.env["stock.move"].flush(["picking_id", "origin", "state"])
+        self.env.cr.execute(
+            """
+            SELECT picking_id, array_agg(DISTINCT origin)
+            FROM stock_move
+            WHERE picking_id IN %s
+                AND state != 'cancel'
+                AND origin IS NOT NULL
+                AND origin != ''
+            GROUP BY picking_id
+            """,
+            (tuple(self.ids),),
+        )
+        for picking_id, picking_origins in self.env.cr.fetchall():
+            origins[picking_id] = sorted(picking_origins)
+        return origins
+
+    @api.model
+    def _render_merged_origin(self, origins):
+        """Render the merged origin of a transfer.
+
+        When the parameter
+        ``stock_picking_group_by_partner_by_carrier.merged_origin_limit`` is
+        set, only this number of origins is displayed followed by the number
+        of the ones left out.
+        """
+        limit = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("stock_picking_group_by_partner_by_carrier.merged_origin_limit")
+            or 0
+        )
+        if limit > 0 and len(origins) > limit:
+            return "{} (+{})".format(" ".join(origins[:limit]), len(origins) - limit)
+        return " ".join(origins)
+
     def _prepare_merged_origin(self):
         """Concatenate all origin together.
         Note that in standard, only max 5 are displayed"""
-        moves = self.move_lines.filtered(lambda m: m.state != "cancel")
-        origins = moves.filtered(lambda m: m.origin).mapped("origin")
-        origins = sorted(list(set(origins)))
-        return " ".join(origins)
+        self.ensure_one()
+        return self._render_merged_origin(self._get_merged_origins()[self.id])
+
+    def _write_merged_origins(self, origins_by_picking):
+        """Write the origins of the transfers, and their rendered origin,
+        only on the ones that changed, at once per value
+
+        :param origins_by_picking: dict with the set of origins by transfer id
+        """
+        pickings_by_values = {}
+        for picking in self:
+            origins = sorted(origins_by_picking[picking.id])
+            merged_origins = "\n".join(origins)
+            origin = self._render_merged_origin(origins)
+            if (
+                merged_origins == picking.merged_origins
+                and origin == (picking.origin or "")
+            ):
+                continue
+            key = (merged_origins, origin)
+            pickings_by_values.setdefault(key, self.browse())
+            pickings_by_values[key] |= picking
+        for (merged_origins, origin), pickings in pickings_by_values.items():
+            pickings.write({"merged_origins": merged_origins, "origin": origin})
+
+    def _get_tracked_merged_origins(self):
+        """Return the set of origins maintained on the transfer"""
+        self.ensure_one()
+        return set(filter(None, (self.merged_origins or "").split("\n")))
 
     def _update_merged_origin(self):
-        self.origin = self._prepare_merged_origin()
+        """Rebuild the origins of the transfers from all their moves.
+
+        The origins are then maintained by delta: this is used for the
+        transfers not tracked yet and to repair them.
+        """
+        merged_origins = self._get_merged_origins()
+        self._write_merged_origins(
+            {picking_id: set(origins) for picking_id, origins in merged_origins.items()}
+        )
+
+    def _add_merged_origins(self, origins_by_picking):
+        """Add origins to the transfers, such as the ones of the moves merged
+        in them
+
+        :param origins_by_picking: dict with the set of origins by transfer id
+        """
+        untracked = self.filtered(lambda picking: picking.merged_origins is False)
+        untracked._update_merged_origin()
+        tracked = self - untracked
+        tracked._write_merged_origins(
+            {
+                picking.id: picking._get_tracked_merged_origins()
+                | origins_by_picking.get(picking.id, set())
+                for picking in tracked
+            }
+        )
+
+    def _remove_merged_origins(self, origins_by_picking):
+        """Remove origins from the transfers, such as the ones of their
+        canceled moves, unless other moves still to do have them
+
+        :param origins_by_picking: dict with the set of origins by transfer id
+        """
+        untracked = self.filtered(lambda picking: picking.merged_origins is False)
+        untracked._update_merged_origin()
+        tracked = self - untracked
+        removed = set().union(
+            *(origins_by_picking.get(picking.id, set()) for picking in tracked)
+        )
+        if not removed:
+            return
+        self.env["stock.move"].flush(["picking_id", "origin", "state"])
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT picking_id, origin
+            FROM stock_move
+            WHERE picking_id IN %s
+                AND origin IN %s
+                AND state != 'cancel'
+            """,
+            (tuple(tracked.ids), tuple(removed)),
+        )
+        kept = set(self.env.cr.fetchall())
+        tracked._write_merged_origins(
+            {
+                picking.id: {
+                    origin
+                    for origin in picking._get_tracked_merged_origins()
+                    if origin not in origins_by_picking.get(picking.id, set())
+                    or (picking.id, origin) in kept
+                }
+                for picking in tracked
+            }
+        )
+
+    @api.model
+    def _get_moves_origins_by_picking(self, moves):
+        """Return the set of origins of the moves by transfer id"""
+        origins_by_picking = {}
+        for move in moves:
+            if move.picking_id and move.origin:
+                origins_by_picking.setdefault(move.picking_id.id, set()).add(
+                    move.origin
+                )
+        return origins_by_picking
+
+    @api.model
+    def _post_origin_links(self, origin_links):
+        """Post at once the messages linking transfers to their sales
+
+        :param origin_links: dict with the set of sale ids by transfer id
+        """
+        view = self.env.ref("mail.message_origin_link")
+        bodies = {}
+        for picking in self.browse(list(origin_links)):
+            sales = self.env["sale.order"].browse(sorted(origin_links[picking.id]))
+            bodies[picking.id] = view._render(
+                {"self": picking, "object": picking, "origin": sales, "edit": True},
+                engine="ir.qweb",
+                minimal_qcontext=True,
+            )
+        self.browse(list(bodies))._message_log_batch(
+            bodies,
+            subtype_id=self.env.ref("mail.mt_note").id,
+            message_type="notification",
+        )
 
     def _prepare_merge_procurement_group_values(self, move_groups):
         """Build a new procurement group that is the merge of given procurement
@@ -93,16 +452,34 @@ class StockPicking(models.Model):
 
     def _merge_procurement_groups(self):
         self.ensure_one()
+        merge = self._prepare_merge_procurement_groups()
+        self._apply_merge_procurement_groups([merge])
+        return merge["merged"]
+
+    def _prepare_merge_procurement_groups(self):
+        """Compute how the procurement groups of the transfer have to be
+        merged, without writing anything.
+
+        :returns: a dict with the keys:
+            - merged: whether the procurement groups are merged
+            - group: the group to use, or the one to copy to a new group
+            - group_values: values to copy or to write on the group
+            - new_group: whether a new group is created
+            - moves: the moves to put in the group
+        """
+        self.ensure_one()
+        res = {
+            "merged": False,
+            "group": self.group_id,
+            "group_values": {},
+            "new_group": False,
+            "moves": self.env["stock.move"],
+        }
         if self._is_grouping_disabled():
-            return False
+            return res
         if self.picking_type_id.code != "outgoing":
-            return False
-        group_pickings = self.move_lines.group_id.picking_ids.filtered(
-            # Do no longer modify a printed or done transfer: they are
-            # started and their group is now fixed. It prevents keeping
-            # old, done sales orders in new groups forever
-            lambda picking: not (picking.printed or picking.state == "done")
-        )
+            return res
+        group_pickings = self._get_merge_group_pickings()
         moves = group_pickings.move_lines
         base_group = self.group_id
 
@@ -111,39 +488,106 @@ class StockPicking(models.Model):
         # procurement group is required
         if len(moves.original_group_id) > 1 and base_group in moves.original_group_id:
             # Create a new procurement group
-            new_group = base_group.copy(
-                self._prepare_merge_procurement_group_values(moves.original_group_id)
+            res.update(
+                merged=True,
+                new_group=True,
+                group_values=self._prepare_merge_procurement_group_values(
+                    moves.original_group_id
+                ),
+                moves=group_pickings.move_lines,
             )
-            group_pickings.move_lines.group_id = new_group
-            return True
+            return res
 
         new_moves = moves.filtered(lambda move: move.group_id != base_group)
         old_moves = moves - new_moves
+        res["moves"] = new_moves
         if new_moves.original_group_id - old_moves.original_group_id:
             # A move with a new procurement group has been added. Adapt
             # the procurement group
             closed_pickings = self.move_lines.group_id.picking_ids.filtered(
                 lambda picking: picking.printed or picking.state == "done"
             )
+            res.update(
+                merged=True,
+                group_values=self._prepare_merge_procurement_group_values(
+                    moves.original_group_id
+                ),
+            )
             if closed_pickings:
                 # Do no longer modify a printed or done transfer: they
                 # are started and their group is now fixed. So create a
                 # new procurement group
-                new_group = base_group.copy(
-                    self._prepare_merge_procurement_group_values(
-                        moves.original_group_id
-                    )
-                )
-                group_pickings.move_lines.group_id = new_group
-                return True
+                res.update(new_group=True, moves=group_pickings.move_lines)
+        return res
 
-            base_group.write(
-                self._prepare_merge_procurement_group_values(moves.original_group_id)
-            )
-            new_moves.group_id = base_group
-            return True
-        new_moves.group_id = base_group
-        return False
+    def _get_merge_group_pickings(self):
+        self.ensure_one()
+        return self.move_lines.group_id.picking_ids.filtered(
+            # Do no longer modify a printed or done transfer: they are
+            # started and their group is now fixed. It prevents keeping
+            # old, done sales orders in new groups forever
+            lambda picking: not (picking.printed or picking.state == "done")
+        )
+
+    @api.model
+    def _apply_merge_procurement_groups(self, merges):
+        """Write the merges prepared by `_prepare_merge_procurement_groups`:
+        the new groups are created at once and the moves are written once
+        per procurement group"""
+        to_create = [merge for merge in merges if merge["new_group"]]
+        vals_list = []
+        for merge in to_create:
+            vals_list += merge["group"].copy_data(merge["group_values"])
+        new_groups = self.env["procurement.group"].create(vals_list)
+        for merge, new_group in zip(to_create, new_groups):
+            merge["group"] = new_group
+        moves_by_group = {}
+        for merge in merges:
+            if merge["merged"] and not merge["new_group"]:
+                merge["group"].write(merge["group_values"])
+            if merge["moves"]:
+                moves_by_group.setdefault(merge["group"], self.env["stock.move"])
+                moves_by_group[merge["group"]] |= merge["moves"]
+        for group, moves in moves_by_group.items():
+            moves.group_id = group
+
+    def _batch_merge_procurement_groups(self):
+        """Merge the procurement groups of several transfers at once. The
+        transfers sharing procurement groups with others are merged one after
+        the other, as each merge changes what the next one has to do.
+
+        :returns: the transfers whose procurement groups have been merged
+        """
+        footprints = {}
+        for picking in self.sorted("id"):
+            group_pickings = picking._get_merge_group_pickings()
+            footprints[picking] = {
+                ("picking", x) for x in (group_pickings | picking).ids
+            }
+            footprints[picking] |= {
+                ("group", x) for x in (group_pickings | picking).move_lines.group_id.ids
+            }
+        counter = Counter(x for footprint in footprints.values() for x in footprint)
+        independent = [
+            picking
+            for picking, footprint in footprints.items()
+            if all(counter[x] == 1 for x in footprint)
+        ]
+        merges = [
+            picking._prepare_merge_procurement_groups() for picking in independent
+        ]
+        self._apply_merge_procurement_groups(merges)
+        merged = self.browse(
+            [
+                picking.id
+                for picking, merge in zip(independent, merges)
+                if merge["merged"]
+            ]
+        )
+        for picking in footprints:
+            if picking not in independent and picking._merge_procurement_groups():
+                merged |= picking
+        return merged
 
     def copy(self, defaults=None):
         if self.env.context.get("picking_no_copy_if_can_group") and self.move_lines:
@@ -182,6 +626,114 @@ class StockPicking(models.Model):
     def _delivery_report_state_is_done(self):
         return self.state == "done"
 
+    def _delivery_report_use_cache(self):
+        """Whether the lines of the delivery slip can be taken from the cache.
+
+        Only the lines of done transfers are cached, as they don't change
+        anymore, and only if the system parameter
+        ``stock_picking_group_by_partner_by_carrier.delivery_report_cache``
+        is set.
+        """
+        self.ensure_one()
+        return self._delivery_report_state_is_done() and bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param(
+                "stock_picking_group_by_partner_by_carrier.delivery_report_cache"
+            )
+        )
+
+    def _prepare_delivery_report_row(self, record):
+        return {"is_header": False, "id": record.id}
+
+    def _prepare_delivery_report_header_row(self, sale):
+        return {
+            "is_header": True,
+            "description": sale.get_name_for_delivery_line(),
+            "origin": sale.name,
+        }
+
+    def _prepare_delivery_report_rows(self):
+        """Build in one pass the rows of the delivery slip.
+
+        The rows are plain dicts, either a header for a sale order with the
+        keys ``description`` and ``origin``, or the ``id`` of a move (or of a
+        move line when the transfer is done).
+        """
+        self.ensure_one()
+        is_done = self._delivery_report_state_is_done()
+        moves = self._get_sorted_moves()
+        if not is_done:
+            moves = moves.filtered("reserved_availability")
+        if len(moves.sale_line_id.order_id) <= 1:
+            records = self._get_sorted_move_lines() if is_done else moves
+            return [self._prepare_delivery_report_row(record) for record in records]
+        rows = []
+        for sale, sale_moves in self._group_moves_by_order(moves):
+            if sale:
+                rows.append(self._prepare_delivery_report_header_row(sale))
+            for move in sale_moves:
+                records = move.move_line_ids if is_done else move
+                rows.extend(self._prepare_delivery_report_row(r) for r in records)
+        return rows
+
+    @api.model
+    @tools.ormcache("picking_id", "state", "write_date", "lines_write_date", "lang")
+    def _get_delivery_report_rows_cached(
+        self, picking_id, state, write_date, lines_write_date, lang
+    ):
+        # The rows are shared between the calls: they must not be modified
+        picking = self.browse(picking_id).with_context(lang=lang)
+        return tuple(picking._prepare_delivery_report_rows())
+
+    def _get_delivery_report_lines_write_date(self):
+        """Return the last update of the moves and move lines of the transfer,
+        as editing them doesn't update the transfer"""
+        self.ensure_one()
+        self.env["stock.move"].flush(["picking_id", "write_date"])
+        self.env["stock.move.line"].flush(["picking_id", "write_date"])
+        self.env.cr.execute(
+            """
+            SELECT GREATEST(
+                (SELECT MAX(write_date) FROM stock_move WHERE picking_id = %(id)s),
+                (SELECT MAX(write_date) FROM stock_move_line
+                 WHERE picking_id = %(id)s)
+            )
+            """,
+            {"id": self.id},
+        )
+        return self.env.cr.fetchone()[0]
+
+    def _get_delivery_report_rows(self):
+        self.ensure_one()
+        if self._delivery_report_use_cache():
+            return self._get_delivery_report_rows_cached(
+                self.id,
+                self.state,
+                self.write_date,
+                self._get_delivery_report_lines_write_date(),
+                self.env.context.get("lang"),
+            )
+        return self._prepare_delivery_report_rows()
+
+    def _prepare_delivery_report_fake_record(self):
+        """Values of the records used as separators for the sale orders"""
+        output = self.env.ref("stock.stock_location_output")
+        fake_record = {
+            "product_id": 1,
+            "product_uom_qty": 0,
+            "company_id": self.env.user.company_id.id,
+            "location_id": output.id,
+            "location_dest_id": output.id,
+        }
+        uom_field = "product_uom"
+        if self._delivery_report_state_is_done():
+            uom_field = "product_uom_id"
+        else:
+            fake_record["name"] = "fake move"
+        fake_record[uom_field] = self.env.ref("uom.product_uom_unit").id
+        return fake_record
+
     def get_delivery_report_lines(self):
         """Return the lines that will be on the report.
 
@@ -190,50 +742,23 @@ class StockPicking(models.Model):
         Otherwise standard records are returned.
         """
         self.ensure_one()
-        moves = self._get_sorted_moves()
-        if not self._delivery_report_state_is_done():
-            moves = moves.filtered("reserved_availability")
-
-        if len(moves.mapped("sale_line_id.order_id")) > 1:
-            grouped_moves = self._group_moves_by_order(moves)
-            fake_record = {
-                "product_id": 1,
-                "product_uom_qty": 0,
-                "product_uom": self.env.ref("uom.product_uom_unit").id,
-                "company_id": self.env.user.company_id.id,
-                "location_id": self.env.ref("stock.stock_location_output").id,
-                "location_dest_id": self.env.ref("stock.stock_location_output").id,
-            }
-            if not self._delivery_report_state_is_done():
-                sales_and_moves = self.env["stock.move"]
-                fake_record["name"] = "fake move"
-                for sale, sale_moves in grouped_moves:
-                    line_desc = sale.get_name_for_delivery_line()
-                    fake_record.update(
-                        {"description_picking": line_desc, "origin": sale.name}
-                    )
-                    sales_and_moves |= sales_and_moves.new(fake_record.copy())
-                    for move in sale_moves:
-                        sales_and_moves |= move
-                return sales_and_moves
-            else:
-                sales_and_moves = self.env["stock.move.line"]
-                fake_record["product_uom_id"] = fake_record.pop("product_uom")
-                for sale, sale_moves in grouped_moves:
-                    if sale:
-                        line_desc = sale.get_name_for_delivery_line()
-                        fake_record.update(
-                            {"description_picking": line_desc, "origin": sale.name}
-                        )
-                        sales_and_moves |= sales_and_moves.new(fake_record.copy())
-                    for move in sale_moves:
-                        for move_line in move.move_line_ids:
-                            sales_and_moves |= move_line
-                return sales_and_moves
-        elif not self._delivery_report_state_is_done():
-            return moves
-        else:
-            return self._get_sorted_move_lines()
+        model = self.env["stock.move"]
+        if self._delivery_report_state_is_done():
+            model = self.env["stock.move.line"]
+        fake_record = None
+        ids = []
+        for row in self._get_delivery_report_rows():
+            if not row["is_header"]:
+                ids.append(row["id"])
+                continue
+            if fake_record is None:
+                fake_record = self._prepare_delivery_report_fake_record()
+            fake_record.update(
+                {"description_picking": row["description"], "origin": row["origin"]}
+            )
+            ids.append(model.new(fake_record.copy()).id)
+        # Browse all the lines at once so they are prefetched together
+        return model.browse(ids)
 
     def get_customer_refs(self):
         """Returns all unique sales order customer references."""
@@ -1,3 +1,4 @@
 from . import test_grouping_disable_on_partner
 from . import test_grouping
 from . import test_report
+from . import test_benchmark
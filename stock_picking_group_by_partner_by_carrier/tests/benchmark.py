@@ -0,0 +1,182 @@
+# Copyright 2020 Camptocamp (https://www.camptocamp.com)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import logging
+import time
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+
+class GroupingBenchmarkMixin:
+    """Benchmark of the assignation of moves to grouped transfers, to mix
+    with a `SavepointCase`
+
+    The data set is generated with ``partner_count`` partners, having each
+    ``order_count`` sale orders of ``line_count`` lines. The orders of a
+    partner alternate between two carriers.
+
+    Each operation is run on the data set and on a data set with twice the
+    partners. The number of queries and the time are logged, and the test
+    fails when doubling the data set more than doubles the queries: the
+    operations cost a fixed number of queries plus a number per order, so a
+    query count growing faster than the number of orders is a regression.
+
+    The queries per order are checked against ``max_queries_per_order`` only
+    for the operations it has a limit for. No limit is shipped as none has
+    been measured yet: set them from the counts logged by a run on a real
+    database, with a margin of 10%.
+
+    The test classes using it are tagged ``benchmark`` and left out of the
+    standard tests: run them with ``--test-tags benchmark``.
+    """
+
+    partner_count = 2
+    order_count = 3
+    line_count = 2
+    # maximum number of queries per sale order by operation (confirm,
+    # backorder, cancel), from a measured run
+    max_queries_per_order = {}
+    # allowed ratio between the queries on the doubled and on the base data
+    # set: a cost linear in the number of orders doubles at most
+    max_scaling_ratio = 2.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.warehouse = cls.env.ref("stock.warehouse0")
+        cls.warehouse.group_shippings = True
+        cls.carriers = cls.env["delivery.carrier"].create(
+            [
+                {
+                    "name": "Benchmark Carrier {}".format(index),
+                    "product_id": cls.env.ref("delivery.product_product_delivery").id,
+                }
+                for index in range(2)
+            ]
+        )
+        cls.products = cls.env["product.product"].create(
+            [
+                {"name": "Benchmark Product {}".format(index), "type": "product"}
+                for index in range(cls.line_count)
+            ]
+        )
+        for product in cls.products:
+            cls.env["stock.quant"]._update_available_quantity(
+                product, cls.warehouse.lot_stock_id, 1000000
+            )
+
+    def _generate_orders(self, partner_count):
+        partners = self.env["res.partner"].create(
+            [
+                {"name": "Benchmark Partner {}".format(index)}
+                for index in range(partner_count)
+            ]
+        )
+        vals_list = []
+        for partner in partners:
+            for index in range(self.order_count):
+                vals_list.append(
+                    {
+                        "partner_id": partner.id,
+                        "partner_invoice_id": partner.id,
+                        "partner_shipping_id": partner.id,
+                        "carrier_id": self.carriers[index % 2].id,
+                        "pricelist_id": self.env.ref("product.list0").id,
+                        "warehouse_id": self.warehouse.id,
+                        "order_line": [
+                            (
+                                0,
+                                0,
+                                {
+                                    "name": product.name,
+                                    "product_id": product.id,
+                                    "product_uom_qty": 10,
+                                    "product_uom": product.uom_id.id,
+                                    "price_unit": 1,
+                                },
+                            )
+                            for product in self.products
+                        ],
+                    }
+                )
+        return self.env["sale.order"].create(vals_list)
+
+    @contextmanager
+    def _measure(self, name, orders):
+        """Count the queries of the block and check them against the limit
+        of the operation
+
+        Yields a dict where the number of queries is set once the block is
+        done.
+        """
+        self.env["base"].flush()
+        result = {}
+        query_count = self.env.cr.sql_log_count
+        start = time.perf_counter()
+        yield result
+        self.env["base"].flush()
+        result["queries"] = self.env.cr.sql_log_count - query_count
+        _logger.info(
+            "%s on %s orders: %s queries (%.1f per order) in %.3fs",
+            name,
+            len(orders),
+            result["queries"],
+            result["queries"] / len(orders),
+            time.perf_counter() - start,
+        )
+        if name in self.max_queries_per_order:
+            self.assertLessEqual(
+                result["queries"],
+                self.max_queries_per_order[name] * len(orders),
+                "Too many queries for %s" % name,
+            )
+
+    def _assert_scaling(self, name, base, doubled):
+        self.assertLessEqual(
+            doubled["queries"],
+            base["queries"] * self.max_scaling_ratio,
+            "The queries for %s grow faster than the number of orders" % name,
+        )
+
+    def _run_confirm(self, partner_count):
+        orders = self._generate_orders(partner_count)
+        with self._measure("confirm", orders) as result:
+            orders.action_confirm()
+        return result
+
+    def _run_backorder(self, partner_count):
+        orders = self._generate_orders(partner_count)
+        orders.action_confirm()
+        pickings = orders.picking_ids
+        pickings.action_assign()
+        for move_line in pickings.move_line_ids:
+            move_line.qty_done = move_line.product_uom_qty / 2
+        with self._measure("backorder", orders) as result:
+            pickings._action_done()
+        self.assertEqual(set(pickings.mapped("state")), {"done"})
+        return result
+
+    def _run_cancel(self, partner_count):
+        orders = self._generate_orders(partner_count)
+        orders.action_confirm()
+        to_cancel = orders[::2]
+        with self._measure("cancel", to_cancel) as result:
+            to_cancel.action_cancel()
+        self.assertEqual(set(to_cancel.mapped("state")), {"cancel"})
+        return result
+
+    def _benchmark(self, name, run):
+        base = run(self.partner_count)
+        doubled = run(self.partner_count * 2)
+        self._assert_scaling(name, base, doubled)
+
+    def test_benchmark_confirm(self):
+        self._benchmark("confirm", self._run_confirm)
+
+    def test_benchmark_backorder(self):
+        self._benchmark("backorder", self._run_backorder)
+
+    def test_benchmark_cancel(self):
+        self._benchmark("cancel", self._run_cancel)
@@ -0,0 +1,11 @@
+# Copyright 2020 Camptocamp (https://www.camptocamp.com)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from odoo.tests import SavepointCase, tagged
+
+from .benchmark import GroupingBenchmarkMixin
+
+
+@tagged("-standard", "post_install", "-at_install", "benchmark")
+class TestGroupingBenchmark(GroupingBenchmarkMixin, SavepointCase):
+    pass
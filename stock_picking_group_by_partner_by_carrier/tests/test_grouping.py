@@ -99,6 +99,30 @@ class TestGroupBy(TestGroupByBase):
         self.assertTrue(so1.name in so1.picking_ids[0].origin)
         self.assertTrue(so2.name in so2.picking_ids[0].origin)
 
+    def test_sale_stock_mixed_picking_policy_same_call(self):
+        """Sales with mixed picking policies are confirmed at once
+
+        -> the "deliver all at once" sale keeps its own transfer with all its
+        lines, the other ones are merged together
+        """
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so1.picking_policy = "one"
+        line_values = self._prepare_new_sale_order_line(5)
+        product = self.env.ref("product.product_delivery_02")
+        line_values.update(
+            name=product.name, product_id=product.id, product_uom=product.uom_id.id
+        )
+        so1.write({"order_line": [(0, 0, line_values)]})
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so3 = self._get_new_sale_order(amount=12, carrier=self.carrier1)
+        (so2 | so1 | so3).action_confirm()
+        self.assertEqual(len(so1.picking_ids), 1)
+        self.assertEqual(len(so1.picking_ids.move_lines), 2)
+        self.assertEqual(so2.picking_ids, so3.picking_ids)
+        self.assertNotEqual(so1.picking_ids, so2.picking_ids)
+        self.assertEqual(so2.picking_ids.group_id.sale_ids, so2 | so3)
+        self.assertEqual(so1.picking_ids.move_lines.group_id, so1.procurement_group_id)
+
     def test_printed_pick_no_merge(self):
         """1st sale order ship is printed, 2nd sale order not merged"""
         so1 = self._get_new_sale_order(carrier=self.carrier1)
@@ -446,3 +470,175 @@ class TestGroupBy(TestGroupByBase):
         self.assertEqual(picking.state, "done")
         self.assertTrue(picking.backorder_ids)
         self.assertNotEqual(picking, picking.backorder_ids)
+
+    def test_assignation_cache(self):
+        """Moves of several sales confirmed together are grouped as when
+        they are confirmed one by one"""
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so3 = self._get_new_sale_order(amount=12, carrier=self.carrier2)
+        (so1 | so2 | so3).action_confirm()
+        self.assertTrue(so1.picking_ids)
+        self.assertEqual(so1.picking_ids, so2.picking_ids)
+        self.assertNotEqual(so1.picking_ids, so3.picking_ids)
+        self.assertEqual(so3.picking_ids.carrier_id, self.carrier2)
+        so4 = self._get_new_sale_order(amount=13, carrier=self.carrier2)
+        so4.action_confirm()
+        self.assertEqual(so3.picking_ids, so4.picking_ids)
+        # The cache only lives during the assignation
+        self.assertNotIn(
+            "stock_picking_group_by_partner_by_carrier.assignation",
+            self.env.cr.cache,
+        )
+
+    def test_batch_merge_procurement_groups(self):
+        """Procurement groups of several transfers are merged at once"""
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so3 = self._get_new_sale_order(amount=12, carrier=self.carrier2)
+        so4 = self._get_new_sale_order(amount=13, carrier=self.carrier2)
+        (so1 | so2 | so3 | so4).action_confirm()
+        picking1 = so1.picking_ids
+        picking2 = so3.picking_ids
+        self.assertEqual(so2.picking_ids, picking1)
+        self.assertEqual(so4.picking_ids, picking2)
+        self.assertEqual(picking1.group_id, picking1.move_lines.group_id)
+        self.assertEqual(picking1.group_id.sale_ids, so1 | so2)
+        self.assertEqual(picking2.group_id, picking2.move_lines.group_id)
+        self.assertEqual(picking2.group_id.sale_ids, so3 | so4)
+        self.assertIn(so1.name, picking1.origin)
+        self.assertIn(so2.name, picking1.origin)
+
+    def test_merged_origin(self):
+        """The merged origin follows the moves of the transfer"""
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so3 = self._get_new_sale_order(amount=12, carrier=self.carrier1)
+        (so1 | so2 | so3).action_confirm()
+        picking = so1.picking_ids
+        self.assertEqual(
+            picking.origin, " ".join(sorted([so1.name, so2.name, so3.name]))
+        )
+        self.assertEqual(
+            picking.merged_origins, "\n".join(sorted([so1.name, so2.name, so3.name]))
+        )
+        so2.action_cancel()
+        self.assertEqual(picking.origin, " ".join(sorted([so1.name, so3.name])))
+        self.assertEqual(
+            picking.merged_origins, "\n".join(sorted([so1.name, so3.name]))
+        )
+        # The origins not tracked yet are rebuilt from the moves
+        picking.merged_origins = False
+        so4 = self._get_new_sale_order(amount=13, carrier=self.carrier1)
+        so4.action_confirm()
+        self.assertEqual(so4.picking_ids, picking)
+        self.assertEqual(
+            picking.origin, " ".join(sorted([so1.name, so3.name, so4.name]))
+        )
+        so4.action_cancel()
+        self.assertEqual(picking.origin, " ".join(sorted([so1.name, so3.name])))
+        self.env["ir.config_parameter"].sudo().set_param(
+            "stock_picking_group_by_partner_by_carrier.merged_origin_limit", 1
+        )
+        picking._update_merged_origin()
+        self.assertEqual(picking.origin, "{} (+1)".format(min(so1.name, so3.name)))
+        # An origin set by hand is kept when moves are canceled outside of a
+        # sale cancellation
+        picking.origin = "Manual origin"
+        picking.move_lines.filtered(
+            lambda m: m.original_group_id == so1.procurement_group_id
+        )._action_cancel()
+        self.assertEqual(picking.origin, "Manual origin")
+
+    def test_picking_sale_ids(self):
+        """The sales of the transfers follow the moves and their groups"""
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so1.action_confirm()
+        picking = so1.picking_ids
+        self.assertEqual(picking.sale_ids, so1)
+        so2.action_confirm()
+        self.assertEqual(so2.picking_ids, picking)
+        self.assertEqual(picking.sale_ids, so1 | so2)
+        # The check job fixes wrong sales
+        picking.sale_ids = [(3, so2.id)]
+        self.assertEqual(self.env["stock.picking"]._cron_check_sale_ids(), picking)
+        self.assertEqual(picking.sale_ids, so1 | so2)
+        self.assertFalse(self.env["stock.picking"]._cron_check_sale_ids())
+
+    def test_cancelling_sale_orders_at_once(self):
+        """2 of 3 sale orders sharing a picking are cancelled together
+
+        -> only the moves of the remaining sale order are todo"""
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so3 = self._get_new_sale_order(amount=12, carrier=self.carrier1)
+        (so1 | so2 | so3).action_confirm()
+        picking = so1.picking_ids
+        self.assertEqual(so3.picking_ids, picking)
+        (so1 | so2).action_cancel()
+        self.assertNotEqual(picking.state, "cancel")
+        for move in picking.move_lines:
+            if move.sale_line_id.order_id == so3:
+                self.assertEqual(move.state, "confirmed")
+            else:
+                self.assertEqual(move.state, "cancel")
+        self.assertEqual((so1 | so2).mapped("state"), ["cancel", "cancel"])
+        self.assertEqual(so3.state, "sale")
+        self.assertEqual(picking.origin, so3.name)
+
+    def test_deferred_origin_link_message(self):
+        """The messages linking the transfers to the sales are posted once
+        per transfer at the end of the assignation"""
+        self.env["ir.config_parameter"].sudo().set_param(
+            "stock_picking_group_by_partner_by_carrier.defer_origin_link_message", 1
+        )
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so1.action_confirm()
+        picking = so1.picking_ids
+        messages = picking.message_ids
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so3 = self._get_new_sale_order(amount=12, carrier=self.carrier1)
+        (so2 | so3).action_confirm()
+        self.assertEqual(so3.picking_ids, picking)
+        new_messages = picking.message_ids - messages
+        self.assertEqual(len(new_messages), 1)
+        self.assertIn(so2.name, new_messages.body)
+        self.assertIn(so3.name, new_messages.body)
+        self.assertNotIn(
+            "stock_picking_group_by_partner_by_carrier.assignation_origin_links",
+            self.env.cr.cache,
+        )
+
+    def test_pooled_backorder(self):
+        """The moves left in several transfers validated together are moved
+        to one backorder"""
+        self.env["ir.config_parameter"].sudo().set_param(
+            "stock_picking_group_by_partner_by_carrier.pooled_backorder", 1
+        )
+        so1 = self._get_new_sale_order(carrier=self.carrier1)
+        so1.action_confirm()
+        picking1 = so1.picking_ids
+        # a printed transfer is not grouped anymore
+        picking1.printed = True
+        so2 = self._get_new_sale_order(amount=11, carrier=self.carrier1)
+        so2.action_confirm()
+        picking2 = so2.picking_ids
+        self.assertNotEqual(picking1, picking2)
+        pickings = picking1 | picking2
+        self._update_qty_in_location(
+            picking1.location_id,
+            picking1.move_lines.product_id,
+            sum(pickings.move_lines.mapped("product_uom_qty")),
+        )
+        pickings.action_assign()
+        for move_line in pickings.move_line_ids:
+            move_line.qty_done = move_line.product_uom_qty / 2
+        pickings._action_done()
+        self.assertEqual(pickings.mapped("state"), ["done", "done"])
+        backorder = (so1 | so2).picking_ids - pickings
+        self.assertEqual(len(backorder), 1)
+        self.assertEqual(backorder.backorder_id, picking1)
+        self.assertEqual(backorder.move_lines.sale_line_id.order_id, so1 | so2)
+        self.assertEqual(backorder.sale_ids, so1 | so2)
+        self.assertEqual(backorder.origin, " ".join(sorted([so1.name, so2.name])))
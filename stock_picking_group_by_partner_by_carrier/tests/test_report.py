@@ -153,3 +153,45 @@ class TestReport(TestGroupByBase):
         self.assertTrue(res[1].id)
         self.assertFalse(res[2].id)
         self.assertTrue(res[3].id)
+
+    def test_delivery_report_lines_cache(self):
+        """The lines of a done transfer are cached when enabled"""
+        so1 = self._get_new_sale_order()
+        so2 = self._get_new_sale_order(amount=11)
+        (so1 | so2).action_confirm()
+        picking = so1.picking_ids
+        for line in so1.order_line | so2.order_line:
+            self._update_qty_in_location(
+                picking.location_id, line.product_id, line.product_uom_qty
+            )
+        picking.action_assign()
+        for move_line in picking.move_line_ids:
+            move_line.qty_done = move_line.product_uom_qty
+        picking._action_done()
+        self.env["ir.config_parameter"].sudo().set_param(
+            "stock_picking_group_by_partner_by_carrier.delivery_report_cache", 1
+        )
+        self.assertTrue(picking._delivery_report_use_cache())
+        rows = picking._get_delivery_report_rows()
+        self.assertIs(picking._get_delivery_report_rows(), rows)
+        # Editing a move line invalidates the cached rows
+        move_line = picking.move_line_ids[0]
+        move_line.qty_done += 1
+        self.env.cr.execute(
+            "UPDATE stock_move_line SET write_date = write_date + interval '1 second'"
+            " WHERE id = %s",
+            (move_line.id,),
+        )
+        move_line.invalidate_cache(["write_date"])
+        self.assertIsNot(picking._get_delivery_report_rows(), rows)
+        rows = picking._get_delivery_report_rows()
+        self.assertEqual([row["is_header"] for row in rows], [True, False, True, False])
+        res = picking.get_delivery_report_lines()
+        self.assertEqual(res._name, "stock.move.line")
+        self.assertEqual(res[0].description_picking, so1.get_name_for_delivery_line())
+        self.assertEqual(
+            res[1],
+            picking.move_line_ids.filtered(
+                lambda ml: ml.move_id.sale_line_id.order_id == so1
+            ),
+        )
@@ -5,7 +5,7 @@
     "name": "Stock Picking: group by partner and carrier and scheduled date",
     "Summary": """Delivery orders will be matched by date too.
     """,
-    "version": "14.0.1.0.1",
+    "version": "14.0.1.1.0",
     "development_status": "Alpha",
     "author": "Camptocamp, Odoo Community Association (OCA)",
     "website": "https://github.com/OCA/stock-logistics-workflow",
@@ -15,6 +15,7 @@
     # to avoid depending on `stock_picking_group_by_partner_by_carrier`.
     "depends": ["stock_picking_group_by_partner_by_carrier"],
     "data": ["views/stock_picking_type.xml"],
+    "pre_init_hook": "pre_init_hook",
     "installable": True,
     "license": "AGPL-3",
 }
@@ -0,0 +1,45 @@
+# Copyright 2020 Camptocamp (https://www.camptocamp.com)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+import logging
+
+from odoo.tools.sql import column_exists, create_column
+
+_logger = logging.getLogger(__name__)
+
+
+def pre_init_hook(cr):
+    """Avoid computing the grouping date of every picking on installation"""
+    init_grouping_date(cr)
+
+
+def init_grouping_date(cr):
+    """Fill the grouping date of the pickings with a single query. The
+    picking types grouping by date can only group by day at this point."""
+    if column_exists(cr, "stock_picking", "grouping_date"):
+        return
+    _logger.info("Creating field grouping_date on stock_picking")
+    create_column(cr, "stock_picking", "grouping_date", "timestamp")
+    if not column_exists(cr, "stock_picking_type", "group_pickings_by_date"):
+        return
+    cr.execute(
+        """
+        UPDATE stock_picking sp
+        SET grouping_date = date_trunc(
+            'day', sp.scheduled_date AT TIME ZONE 'UTC' AT TIME ZONE tz.name
+        ) AT TIME ZONE tz.name AT TIME ZONE 'UTC'
+        FROM stock_picking_type spt
+        LEFT JOIN stock_warehouse sw ON sw.id = spt.warehouse_id
+        LEFT JOIN res_partner wp ON wp.id = sw.partner_id
+        JOIN res_company c ON c.id = spt.company_id
+        JOIN res_partner cp ON cp.id = c.partner_id
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(
+                NULLIF(CASE WHEN wp.id IS NULL THEN cp.tz ELSE wp.tz END, ''), 'UTC'
+            ) AS name
+        ) tz
+        WHERE spt.id = sp.picking_type_id
+            AND spt.group_pickings_by_date
+            AND sp.scheduled_date IS NOT NULL
+    """
+    )
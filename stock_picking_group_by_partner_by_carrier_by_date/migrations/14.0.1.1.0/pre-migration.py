@@ -0,0 +1,10 @@
+# Copyright 2020 Camptocamp (https://www.camptocamp.com)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+from odoo.addons.stock_picking_group_by_partner_by_carrier_by_date.hooks import (
+    init_grouping_date,
+)
+
+
+def migrate(cr, version):
+    # Avoid computing the new stored field through the ORM
+    init_grouping_date(cr)
@@ -25,10 +25,6 @@ class StockMove(models.Model):
         domain = []
         if self._skip_assign_picking_group_domain_by_date():
             return domain
-        date_planned = self.date.replace(hour=0, minute=0, second=0)
-        date_planned_end = date_planned.replace(hour=23, minute=59, second=59)
-        domain = [
-            ("scheduled_date", "<=", date_planned_end),
-            ("scheduled_date", ">=", date_planned),
-        ]
+        grouping_date = self.picking_type_id._get_grouping_date(self.date)
+        domain = [("grouping_date", "=", grouping_date)]
         return domain
@@ -0,0 +1,33 @@
+# Copyright 2020 Camptocamp (https://www.camptocamp.com)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, fields, models
+
+
+class StockPicking(models.Model):
+    _inherit = "stock.picking"
+
+    grouping_date = fields.Datetime(
+        compute="_compute_grouping_date",
+        store=True,
+        index=True,
+        help="Technical field. Start of the period of the scheduled date, used "
+        "to group the pickings by date.",
+    )
+
+    @api.depends(
+        "scheduled_date",
+        "picking_type_id.group_pickings_by_date",
+        "picking_type_id.group_pickings_by_date_period",
+        "picking_type_id.warehouse_id.partner_id.tz",
+        "picking_type_id.company_id.partner_id.tz",
+    )
+    def _compute_grouping_date(self):
+        for picking in self:
+            picking_type = picking.picking_type_id
+            if picking_type.group_pickings_by_date and picking.scheduled_date:
+                picking.grouping_date = picking_type._get_grouping_date(
+                    picking.scheduled_date
+                )
+            else:
+                picking.grouping_date = False
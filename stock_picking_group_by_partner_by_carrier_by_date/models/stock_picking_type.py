@@ -1,3 +1,7 @@
+from datetime import timedelta
+
+import pytz
+
 from odoo import fields, models
 
 
@@ -8,3 +12,28 @@ class StockPickingType(models.Model):
         "Group pickings by date",
         help="If `Group pickings` is enabled they will be grouped by date too.",
     )
+    group_pickings_by_date_period = fields.Selection(
+        [("day", "Day"), ("half_day", "Half-day"), ("week", "Week")],
+        string="Group pickings by",
+        default="day",
+        required=True,
+        help="Period of the scheduled dates of the pickings grouped together, "
+        "in the timezone of the warehouse.",
+    )
+
+    def _get_grouping_tz(self):
+        self.ensure_one()
+        partner = self.warehouse_id.partner_id or self.company_id.partner_id
+        return pytz.timezone(partner.tz or "UTC")
+
+    def _get_grouping_date(self, date):
+        """Return the start of the grouping period of the date, in UTC"""
+        self.ensure_one()
+        tz = self._get_grouping_tz()
+        local_date = pytz.utc.localize(date).astimezone(tz).replace(tzinfo=None)
+        start = local_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.group_pickings_by_date_period == "half_day" and local_date.hour >= 12:
+            start = start.replace(hour=12)
+        elif self.group_pickings_by_date_period == "week":
+            start -= timedelta(days=start.weekday())
+        return tz.localize(start).astimezone(pytz.utc).replace(tzinfo=None)
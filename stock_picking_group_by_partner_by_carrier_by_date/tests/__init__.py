@@ -1 +1,2 @@
 from . import test_grouping_by_date
+from . import test_benchmark
@@ -0,0 +1,16 @@
+# Copyright 2020 Camptocamp (https://www.camptocamp.com)
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+
+from odoo.tests import SavepointCase, tagged
+
+from odoo.addons.stock_picking_group_by_partner_by_carrier.tests.benchmark import (
+    GroupingBenchmarkMixin,
+)
+
+
+@tagged("-standard", "post_install", "-at_install", "benchmark")
+class TestGroupingByDateBenchmark(GroupingBenchmarkMixin, SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.warehouse.out_type_id.group_pickings_by_date = True
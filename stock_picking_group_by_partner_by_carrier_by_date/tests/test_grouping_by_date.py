@@ -1,5 +1,7 @@
 # Copyright 2020 Camptocamp SA
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl)
+from datetime import datetime
+
 from freezegun import freeze_time
 
 from odoo.tests import SavepointCase, tagged
@@ -86,3 +88,59 @@ class TestGroupByDate(TestGroupByDateBase):
             p9, p10 = self._create_orders_and_pickings()
             self.assertEqual(p9, p10)
             self.assertNotEqual(p9, p1)
+
+    def test_grouping_date_timezone(self):
+        picking_type = self.warehouse.out_type_id
+        self.warehouse.partner_id.tz = "Europe/Brussels"
+        # 23:30 in Brussels is still the 27th
+        self.assertEqual(
+            picking_type._get_grouping_date(datetime(2020, 11, 27, 22, 30)),
+            datetime(2020, 11, 26, 23, 0),
+        )
+        self.assertEqual(
+            picking_type._get_grouping_date(datetime(2020, 11, 27, 23, 30)),
+            datetime(2020, 11, 27, 23, 0),
+        )
+        picking_type.group_pickings_by_date_period = "half_day"
+        self.assertEqual(
+            picking_type._get_grouping_date(datetime(2020, 11, 27, 10, 30)),
+            datetime(2020, 11, 26, 23, 0),
+        )
+        self.assertEqual(
+            picking_type._get_grouping_date(datetime(2020, 11, 27, 11, 30)),
+            datetime(2020, 11, 27, 11, 0),
+        )
+        picking_type.group_pickings_by_date_period = "week"
+        # 2020-11-27 is a Friday
+        self.assertEqual(
+            picking_type._get_grouping_date(datetime(2020, 11, 27, 11, 30)),
+            datetime(2020, 11, 22, 23, 0),
+        )
+
+    def test_group_by_week(self):
+        self.warehouse.out_type_id.group_pickings_by_date_period = "week"
+        with freeze_time("2020-11-24 12:00:00"):
+            p1, p2 = self._create_orders_and_pickings()
+            self.assertEqual(p1, p2)
+        with freeze_time("2020-11-26 12:00:00"):
+            p3, p4 = self._create_orders_and_pickings()
+            self.assertEqual(p3, p1)
+        with freeze_time("2020-12-01 12:00:00"):
+            p5, p6 = self._create_orders_and_pickings()
+            self.assertEqual(p5, p6)
+            self.assertNotEqual(p5, p1)
+
+    def test_grouping_date_timezone_change(self):
+        picking_type = self.warehouse.out_type_id
+        self.warehouse.partner_id.tz = "UTC"
+        with freeze_time("2020-11-27 12:00:00"):
+            p1, _p2 = self._create_orders_and_pickings()
+        utc_grouping_date = p1.grouping_date
+        self.assertEqual(
+            utc_grouping_date, picking_type._get_grouping_date(p1.scheduled_date)
+        )
+        self.warehouse.partner_id.tz = "Asia/Tokyo"
+        self.assertNotEqual(p1.grouping_date, utc_grouping_date)
+        self.assertEqual(
+            p1.grouping_date, picking_type._get_grouping_date(p1.scheduled_date)
+        )
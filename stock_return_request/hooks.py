@@ -4,6 +4,8 @@
 import logging
 
 from odoo import SUPERUSER_ID, api
+from odoo.tools import split_every
+from odoo.tools.sql import column_exists, create_column
 
 _logger = logging.getLogger(__name__)
 
@@ -37,58 +39,150 @@ def pre_init_hook(cr):
             WHERE state = 'done'
         """
         )
+    init_picking_commercial_partner(cr)
+
+
+def init_picking_commercial_partner(cr):
+    """Fill the moves pickings commercial partner with a single query"""
+    if column_exists(cr, "stock_move", "picking_commercial_partner_id"):
+        return
+    _logger.info("Creating field picking_commercial_partner_id on stock_move")
+    create_column(cr, "stock_move", "picking_commercial_partner_id", "int4")
+    cr.execute(
+        """
+        UPDATE stock_move sm
+        SET picking_commercial_partner_id = rp.commercial_partner_id
+        FROM stock_picking sp
+        JOIN res_partner rp ON rp.id = sp.partner_id
+        WHERE sm.picking_id = sp.id
+    """
+    )
 
 
 def post_init_hook(cr, registry):
     """Set moves returnable qty on hand"""
+    init_qty_returnable(cr)
+
+
+def init_qty_returnable(cr, chunk_size=50000, commit=False):
+    """Set-based initialization of the returnable quantities that the
+    pre_init_hook can't solve directly: pending moves without returns and
+    done moves with returns, which are solved level by level from the
+    deepest returns up to their origin moves.
+
+    The done moves with returns to solve are kept in a work table, so the
+    process can be run from a shell with ``commit=True`` on large databases
+    to commit every chunk and resume from where it was left if interrupted.
+    """
     with api.Environment.manage():
         env = api.Environment(cr, SUPERUSER_ID, {})
-        moves_draft = env["stock.move"].search([("state", "in", ["draft", "cancel"])])
-        moves_no_return_pendant = env["stock.move"].search(
-            [
-                ("returned_move_ids", "=", False),
-                ("state", "not in", ["draft", "cancel", "done"]),
-            ]
+        cr.execute(
+            """
+            SELECT 1 FROM information_schema.tables
+            WHERE table_name = 'stock_return_request_qty_returnable_todo'
+        """
         )
-        moves_by_reserved_availability = {}
-        for move in moves_no_return_pendant:
-            moves_by_reserved_availability.setdefault(move.reserved_availability, [])
-            moves_by_reserved_availability[move.reserved_availability].append(move.id)
-        for qty, ids in moves_by_reserved_availability.items():
+        if not cr.fetchone():
+            _init_pending_qty_returnable(env, chunk_size)
+            _logger.info("Computing the return chains levels")
             cr.execute(
-                "UPDATE stock_move SET qty_returnable = %s " "WHERE id IN %s",
-                (qty, tuple(ids)),
+                """
+                CREATE TABLE stock_return_request_qty_returnable_todo AS
+                WITH RECURSIVE up (id, height) AS (
+                    SELECT DISTINCT origin_returned_move_id, 1
+                    FROM stock_move
+                    WHERE origin_returned_move_id IS NOT NULL
+                    UNION ALL
+                    SELECT sm.origin_returned_move_id, up.height + 1
+                    FROM up
+                    JOIN stock_move sm ON sm.id = up.id
+                    WHERE sm.origin_returned_move_id IS NOT NULL
+                )
+                SELECT up.id, MAX(up.height) AS height
+                FROM up
+                JOIN stock_move sm ON sm.id = up.id
+                WHERE sm.state = 'done'
+                GROUP BY up.id
+            """
             )
-        moves_no_return_done = env["stock.move"].search(
-            [
-                ("returned_move_ids", "=", False),
-                ("state", "=", "done"),
-            ]
-        )
-        # Recursively solve quantities
-        updated_moves = moves_no_return_done + moves_draft + moves_no_return_pendant
-        remaining_moves = env["stock.move"].search(
-            [
-                ("returned_move_ids", "!=", False),
-                ("state", "=", "done"),
-            ]
-        )
-        while remaining_moves:
-            _logger.info("{} moves left...".format(len(remaining_moves)))
-            remaining_moves, updated_moves = update_qty_returnable(
-                cr, remaining_moves, updated_moves
+            cr.execute(
+                """
+                CREATE INDEX ON stock_return_request_qty_returnable_todo
+                (height, id)
+            """
             )
+            if commit:
+                cr.commit()
+        cr.execute("SELECT COUNT(*) FROM stock_return_request_qty_returnable_todo")
+        remaining = cr.fetchone()[0]
+        while remaining:
+            _logger.info("%s moves with returns left...", remaining)
+            # The returns of a move are always in a lower level
+            cr.execute(
+                """
+                DELETE FROM stock_return_request_qty_returnable_todo
+                WHERE id IN (
+                    SELECT id FROM stock_return_request_qty_returnable_todo
+                    WHERE height = (
+                        SELECT MIN(height)
+                        FROM stock_return_request_qty_returnable_todo
+                    )
+                    ORDER BY id
+                    LIMIT %s
+                )
+                RETURNING id
+            """,
+                (chunk_size,),
+            )
+            ids = tuple(x[0] for x in cr.fetchall())
+            cr.execute(
+                """
+                UPDATE stock_move sm
+                SET qty_returnable = sm.product_uom_qty - returned.qty
+                FROM (
+                    SELECT origin_returned_move_id AS id,
+                        SUM(COALESCE(qty_returnable, 0)) AS qty
+                    FROM stock_move
+                    WHERE origin_returned_move_id IN %s
+                    GROUP BY origin_returned_move_id
+                ) AS returned
+                WHERE sm.id = returned.id
+            """,
+                (ids,),
+            )
+            remaining -= len(ids)
+            if commit:
+                cr.commit()
+        cr.execute("DROP TABLE stock_return_request_qty_returnable_todo")
+        if commit:
+            cr.commit()
 
 
-def update_qty_returnable(cr, remaining_moves, updated_moves):
-    for move in remaining_moves:
-        if all([x in updated_moves for x in move.returned_move_ids]):
-            quantity_returned = sum(move.returned_move_ids.mapped("qty_returnable"))
-            quantity = move.product_uom_qty - quantity_returned
+def _init_pending_qty_returnable(env, chunk_size):
+    """Moves not done yet without returns can return what they have
+    reserved"""
+    cr = env.cr
+    cr.execute(
+        """
+        SELECT sm.id FROM stock_move sm
+        WHERE sm.state NOT IN ('draft', 'cancel', 'done')
+            AND NOT EXISTS (
+                SELECT 1 FROM stock_move rm
+                WHERE rm.origin_returned_move_id = sm.id
+            )
+        ORDER BY sm.id
+    """
+    )
+    move_ids = [x[0] for x in cr.fetchall()]
+    for ids in split_every(chunk_size, move_ids):
+        _logger.info("Setting reserved quantity on %s pending moves", len(ids))
+        moves_by_reserved_availability = {}
+        for move in env["stock.move"].browse(ids):
+            moves_by_reserved_availability.setdefault(move.reserved_availability, [])
+            moves_by_reserved_availability[move.reserved_availability].append(move.id)
+        for qty, move_ids_qty in moves_by_reserved_availability.items():
             cr.execute(
-                "UPDATE stock_move SET qty_returnable = %s " "WHERE id = %s",
-                (quantity, move.id),
+                "UPDATE stock_move SET qty_returnable = %s " "WHERE id IN %s",
+                (qty, tuple(move_ids_qty)),
             )
-            remaining_moves -= move
-            updated_moves += move
-    return remaining_moves, updated_moves
+        env["stock.move"].invalidate_cache(ids=list(ids))
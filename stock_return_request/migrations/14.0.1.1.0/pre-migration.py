@@ -0,0 +1,8 @@
+# Copyright 2019 Tecnativa - David Vidal
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from odoo.addons.stock_return_request.hooks import init_picking_commercial_partner
+
+
+def migrate(cr, version):
+    # Avoid computing the new stored field through the ORM
+    init_picking_commercial_partner(cr)
@@ -1,6 +1,12 @@
 # Copyright 2019 Tecnativa - David Vidal
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+import logging
+
 from odoo import api, fields, models
+from odoo.tools import float_compare, split_every
+from odoo.tools.sql import index_exists
+
+_logger = logging.getLogger(__name__)
 
 
 class StockMove(models.Model):
@@ -13,6 +19,29 @@ class StockMove(models.Model):
         readonly=True,
         store=True,
     )
+    picking_commercial_partner_id = fields.Many2one(
+        comodel_name="res.partner",
+        related="picking_id.partner_id.commercial_partner_id",
+        string="Transfer Commercial Entity",
+        store=True,
+        index=True,
+        help="Technical field to find returnable moves by partner",
+    )
+
+    def init(self):
+        """Speed up the search of moves to return"""
+        index_name = "stock_move_returnable_partner_product_index"
+        if not index_exists(self.env.cr, index_name):
+            self.env.cr.execute(
+                """
+                CREATE INDEX {} ON stock_move
+                (picking_commercial_partner_id, product_id, date)
+                WHERE state = 'done' AND origin_returned_move_id IS NULL
+                    AND qty_returnable > 0
+            """.format(
+                    index_name
+                )
+            )
 
     @api.depends(
         "state",
@@ -23,7 +52,10 @@ class StockMove(models.Model):
     )
     def _compute_qty_returnable(self):
         """Looks for chained returned moves to compute how much quantity
-        from the original can be returned"""
+        from the original can be returned. The returned moves values are
+        already stored, so there's no need to go down the chain: when a
+        return changes, the dependency triggers the recomputation of its
+        origin moves up the chain, once per level."""
         for move in self.filtered(lambda x: x.state not in ["draft", "cancel"]):
             if not move.returned_move_ids:
                 if move.state == "done":
@@ -31,11 +63,85 @@ class StockMove(models.Model):
                 else:
                     move.qty_returnable = move.reserved_availability
                 continue
-            move.returned_move_ids._compute_qty_returnable()
             move.qty_returnable = move.quantity_done - sum(
                 move.returned_move_ids.mapped("qty_returnable")
             )
 
+    @api.model
+    def _check_qty_returnable(self, date_from=False, date_to=False, fix=False):
+        """Verify the stored returnable quantities of the moves chains whose
+        origin move date is within the given range. The chains are solved
+        from the deepest returns up to their origins.
+
+        :param fix: write the expected values when they differ
+        :returns: dict with move ids as keys and the (stored, expected)
+                  quantities as values for every wrong move
+        :rtype: dictionary
+        """
+        self.flush(["origin_returned_move_id", "date", "qty_returnable"])
+        where = ["origin_returned_move_id IS NULL"]
+        params = []
+        if date_from:
+            where.append("date >= %s")
+            params.append(date_from)
+        if date_to:
+            where.append("date <= %s")
+            params.append(date_to)
+        self.env.cr.execute(
+            """
+            WITH RECURSIVE chain (id, depth) AS (
+                SELECT id, 0 FROM stock_move WHERE {}
+                UNION ALL
+                SELECT sm.id, chain.depth + 1
+                FROM stock_move sm
+                JOIN chain ON sm.origin_returned_move_id = chain.id
+            )
+            SELECT id FROM chain ORDER BY depth DESC, id
+            """.format(
+                " AND ".join(where)
+            ),
+            params,
+        )
+        move_ids = [x[0] for x in self.env.cr.fetchall()]
+        expected = {}
+        wrong = {}
+        for ids in split_every(1000, move_ids):
+            _logger.info(
+                "Checking qty_returnable: %s/%s moves", len(expected), len(move_ids)
+            )
+            for move in self.browse(ids):
+                qty = move.qty_returnable
+                if move.state not in ["draft", "cancel"]:
+                    if move.returned_move_ids:
+                        qty = move.quantity_done - sum(
+                            expected.get(x.id, x.qty_returnable)
+                            for x in move.returned_move_ids
+                        )
+                    elif move.state == "done":
+                        qty = move.quantity_done
+                    else:
+                        qty = move.reserved_availability
+                expected[move.id] = qty
+                if float_compare(
+                    qty,
+                    move.qty_returnable,
+                    precision_rounding=move.product_uom.rounding,
+                ):
+                    wrong[move.id] = (move.qty_returnable, qty)
+            self.invalidate_cache(ids=list(ids))
+        if fix and wrong:
+            moves_by_qty = {}
+            for move_id, (_stored, qty) in wrong.items():
+                moves_by_qty.setdefault(qty, []).append(move_id)
+            for qty, ids in moves_by_qty.items():
+                self.env.cr.execute(
+                    "UPDATE stock_move SET qty_returnable = %s WHERE id IN %s",
+                    (qty, tuple(ids)),
+                )
+            self.invalidate_cache(["qty_returnable"], list(wrong))
+        _logger.info("%s moves with a wrong qty_returnable", len(wrong))
+        return wrong
+
     def _get_lot_returnable_qty(self, lot_id, qty=0):
         """Looks for chained returned moves to compute how much quantity
         from the original can be returned for a given lot"""
@@ -47,3 +153,85 @@ class StockMove(models.Model):
                 qty += sum(mls.mapped("product_uom_qty"))
             qty -= move.returned_move_ids._get_lot_returnable_qty(lot_id)
         return qty
+
+    def _get_lot_done_quantities(self):
+        """Aggregate in one query the done quantities per move and lot for
+        the moves in self and for their done returns.
+
+        :returns: a tuple of two dicts keyed by ``(move_id, lot_id)``: the
+                  quantity done in the move itself and the quantity done in
+                  its returned moves.
+        :rtype: tuple
+        """
+        done_qty = {}
+        returned_qty = {}
+        if not self:
+            return done_qty, returned_qty
+        self.env["stock.move"].flush(["state", "origin_returned_move_id"])
+        self.env["stock.move.line"].flush(["move_id", "lot_id", "qty_done"])
+        self.env.cr.execute(
+            """
+            SELECT sml.move_id, sml.lot_id, SUM(sml.qty_done), FALSE
+            FROM stock_move_line sml
+            WHERE sml.move_id IN %(move_ids)s
+            GROUP BY sml.move_id, sml.lot_id
+            UNION ALL
+            SELECT sm.origin_returned_move_id, sml.lot_id, SUM(sml.qty_done), TRUE
+            FROM stock_move_line sml
+            JOIN stock_move sm ON sm.id = sml.move_id
+            WHERE sm.origin_returned_move_id IN %(move_ids)s
+                AND sm.state = 'done'
+            GROUP BY sm.origin_returned_move_id, sml.lot_id
+            """,
+            {"move_ids": tuple(self.ids)},
+        )
+        for move_id, lot_id, qty, is_return in self.env.cr.fetchall():
+            target = returned_qty if is_return else done_qty
+            target[(move_id, lot_id or False)] = qty or 0.0
+        return done_qty, returned_qty
+
+    def _get_lots_returnable_qty(self):
+        """Set-based version of `_get_lot_returnable_qty`. Solves in one query
+        the returnable quantities by lot of the moves in self following the
+        chains of their returns.
+
+        :returns: a dict with the returnable qty by (move id, lot id)
+        :rtype: dictionary
+        """
+        if not self:
+            return {}
+        self.flush(["state", "origin_returned_move_id"])
+        self.env["stock.move.line"].flush(
+            ["move_id", "lot_id", "qty_done", "product_uom_qty"]
+        )
+        self.env.cr.execute(
+            """
+            WITH RECURSIVE chain (root_id, id, sign) AS (
+                SELECT id, id, 1 FROM stock_move
+                WHERE id IN %(move_ids)s AND state NOT IN ('draft', 'cancel')
+                UNION ALL
+                SELECT chain.root_id, sm.id, -chain.sign
+                FROM stock_move sm
+                JOIN chain ON sm.origin_returned_move_id = chain.id
+                WHERE sm.state NOT IN ('draft', 'cancel')
+            )
+            SELECT chain.root_id, sml.lot_id, SUM(
+                chain.sign * CASE WHEN sm.state = 'done'
+                    THEN sml.qty_done ELSE sml.product_uom_qty END
+            )
+            FROM chain
+            JOIN stock_move sm ON sm.id = chain.id
+            JOIN stock_move_line sml ON sml.move_id = chain.id
+            GROUP BY chain.root_id, sml.lot_id
+            """,
+            {"move_ids": tuple(self.ids)},
+        )
+        return {
+            (move_id, lot_id or False): qty or 0.0
+            for move_id, lot_id, qty in self.env.cr.fetchall()
+        }
+
+    def _action_done(self, cancel_backorder=False):
+        # The returnable lots suggestions are no longer valid
+        self.env.cr.cache.pop("suggest_return_request_lot", None)
+        return super()._action_done(cancel_backorder=cancel_backorder)
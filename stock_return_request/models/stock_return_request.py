@@ -1,8 +1,15 @@
 # Copyright 2019 Tecnativa - David Vidal
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
+import csv
+import io
+import logging
+import tempfile
+
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools import float_compare, float_is_zero
+from odoo.tools import float_compare, float_is_zero, split_every
+
+_logger = logging.getLogger(__name__)
 
 
 class StockReturnRequest(models.Model):
@@ -118,6 +125,17 @@ class StockReturnRequest(models.Model):
         string="Comments",
         help="They will be visible on the report",
     )
+    confirm_queued = fields.Boolean(
+        string="Queued for confirmation",
+        readonly=True,
+        copy=False,
+        help="The request will be confirmed in the background",
+    )
+    confirm_error = fields.Text(
+        string="Confirmation error",
+        readonly=True,
+        copy=False,
+    )
 
     @api.onchange("return_type", "partner_id")
     def onchange_locations(self):
@@ -155,6 +173,35 @@ class StockReturnRequest(models.Model):
                 continue
             one.show_to_refund = True
 
+    def _get_moves_domain(self):
+        """Domain constructor for moves search shared by all the request
+        lines. The product and lot conditions are added by the lines."""
+        self.ensure_one()
+        domain = [
+            ("state", "=", "done"),
+            ("origin_returned_move_id", "=", False),
+            ("qty_returnable", ">", 0),
+        ]
+        if self.from_date:
+            domain += [("date", ">=", self.from_date)]
+        if self.picking_types:
+            domain += [("picking_id.picking_type_id", "in", self.picking_types.ids)]
+        if self.return_type != "internal":
+            domain += [
+                (
+                    "picking_commercial_partner_id",
+                    "=",
+                    self.partner_id.commercial_partner_id.id,
+                )
+            ]
+        # Search for movements coming delivered to that location
+        if self.return_type in ["internal", "customer"]:
+            domain += [("location_dest_id", "=", self.return_from_location.id)]
+        # Return to supplier. Search for moves that came from that location
+        else:
+            domain += [("location_id", "child_of", self.return_to_location.id)]
+        return domain
+
     def _prepare_return_picking(self, picking_dict, moves):
         """Extend to add more values if needed"""
         picking_type = self.env["stock.picking.type"].browse(
@@ -180,6 +227,11 @@ class StockReturnRequest(models.Model):
     def _create_picking(self, pickings, picking_moves):
         """Create return pickings with the proper moves"""
         return_pickings = self.env["stock.picking"]
+        moves_by_picking = {}
+        for move in picking_moves:
+            picking = move.origin_returned_move_id.picking_id
+            moves_by_picking.setdefault(picking, self.env["stock.move"])
+            moves_by_picking[picking] |= move
         for picking in pickings:
             picking_dict = picking.copy_data(
                 {
@@ -187,9 +239,7 @@ class StockReturnRequest(models.Model):
                     "printed": False,
                 }
             )[0]
-            moves = picking_moves.filtered(
-                lambda x: x.origin_returned_move_id.picking_id == picking
-            )
+            moves = moves_by_picking.get(picking, self.env["stock.move"])
             new_picking = return_pickings.create(
                 self._prepare_return_picking(picking_dict, moves)
             )
@@ -246,80 +296,100 @@ class StockReturnRequest(models.Model):
                 one._action_confirm()
         self.recompute()
 
+    def action_queue_confirm(self):
+        """Confirm the requests in the background. Each one is confirmed in
+        its own transaction, so a failing request doesn't prevent the others
+        to be confirmed."""
+        self.filtered(lambda x: x.state == "draft").write(
+            {"confirm_queued": True, "confirm_error": False}
+        )
+        self.env.ref("stock_return_request.ir_cron_confirm_queued")._trigger()
+
+    @api.model
+    def _cron_confirm_queued(self):
+        """Confirm the queued requests one by one, committing each of them,
+        so a failing request doesn't roll back the others. The queue is
+        processed by the single cron of the module, one request after the
+        other."""
+        while True:
+            request = self.search(
+                [("confirm_queued", "=", True), ("state", "=", "draft")],
+                order="id",
+                limit=1,
+            )
+            if not request:
+                break
+            try:
+                with self.env.cr.savepoint():
+                    request._action_confirm()
+                    request.confirm_queued = False
+            except Exception as error:
+                _logger.exception("Error confirming return request %s", request.id)
+                message = error.args and error.args[0] or str(error)
+                request.write({"confirm_queued": False, "confirm_error": message})
+                request.message_post(
+                    body=_("The request couldn't be confirmed: %s") % message
+                )
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()  # pylint: disable=invalid-commit
+
     def _action_confirm(self):
         """Get moves and then try to reserve quantities. Fail if the quantites
-        can't be assigned"""
+        can't be assigned. Return moves are created, confirmed and reserved
+        all at once for the whole request."""
         self.ensure_one()
-        Quant = self.env["stock.quant"]
         if not self.line_ids:
             raise ValidationError(_("Add some products to return"))
         returnable_moves = self.line_ids._get_returnable_move_ids()
-        return_moves = self.env["stock.move"]
-        failed_moves = []
-        done_moves = {}
-        for line in returnable_moves.keys():
-            for qty, move in returnable_moves[line]:
-                if move not in done_moves:
-                    vals = self._prepare_move_default_values(line, qty, move)
-                    return_move = move.copy(vals)
-                else:
-                    return_move = done_moves[move]
-                    return_move.product_uom_qty += qty
-                done_moves.setdefault(move, self.env["stock.move"])
-                done_moves[move] += return_move
-                return_move._action_confirm()
-                # We need to be deterministic with lots to avoid autoassign
-                # thus we create manually the line
+        # A move can be returned from several lines (i.e.: with different
+        # lots) so we gather the quantity to return by origin move.
+        qty_by_move = {}
+        line_by_move = {}
+        for line, moves in returnable_moves.items():
+            for qty, move in moves:
+                qty_by_move[move] = qty_by_move.get(move, 0.0) + qty
+                line_by_move.setdefault(move, line)
+        vals_list = []
+        for move, qty in qty_by_move.items():
+            vals_list += move.copy_data(
+                self._prepare_move_default_values(line_by_move[move], qty, move)
+            )
+        new_moves = self.env["stock.move"].create(vals_list)
+        return_move_by_move = dict(zip(qty_by_move.keys(), new_moves))
+        new_moves._action_confirm()
+        # We need to be deterministic with lots to avoid autoassign
+        # thus we create manually the lines. If not lots, just try standard
+        # assign.
+        lot_allocations = {}
+        assign_allocations = []
+        for line, moves in returnable_moves.items():
+            for qty, move in moves:
+                return_move = return_move_by_move[move]
                 if line.lot_id:
-                    # We try to reserve the stock manually so we ensure there's
-                    # enough to make the return.
-                    vals_list = []
-                    if return_move.location_id.usage == "internal":
-                        try:
-                            quants = Quant._update_reserved_quantity(
-                                line.product_id,
-                                return_move.location_id,
-                                qty,
-                                lot_id=line.lot_id,
-                                strict=False,
-                            )
-                            for q in quants:
-                                vals_list.append(
-                                    (
-                                        0,
-                                        0,
-                                        self._prepare_move_line_values(
-                                            line, return_move, q[1], q[0]
-                                        ),
-                                    )
-                                )
-                        except UserError:
-                            failed_moves.append((line, return_move))
-                    else:
-                        vals_list.append(
-                            (
-                                0,
-                                0,
-                                self._prepare_move_line_values(line, return_move, qty),
-                            )
-                        )
-                    return_move.write(
-                        {
-                            "move_line_ids": vals_list,
-                        }
-                    )
-                    return_moves += return_move
-                    line.returnable_move_ids += return_move
-                # If not lots, just try standard assign
+                    key = (line, return_move.location_id)
+                    lot_allocations.setdefault(key, []).append((qty, return_move))
                 else:
-                    return_move._action_assign()
-                    if return_move.state == "assigned":
-                        return_move.quantity_done = qty
-                        return_moves += return_move
-                        line.returnable_move_ids += return_move
-                    else:
-                        failed_moves.append((line, return_move))
-                        break
+                    assign_allocations.append((line, qty, return_move))
+        move_line_vals_list, failed_moves = self._prepare_lot_move_lines(
+            lot_allocations
+        )
+        returned_moves_by_line = {}
+        for (line, _location), allocations in lot_allocations.items():
+            returned_moves_by_line.setdefault(line, []).extend(
+                x[1].id for x in allocations
+            )
+        self.env["stock.move.line"].create(move_line_vals_list)
+        to_assign = self.env["stock.move"].browse(
+            list(dict.fromkeys(x[2].id for x in assign_allocations))
+        )
+        to_assign._action_assign()
+        qty_done_by_move = {}
+        for line, qty, return_move in assign_allocations:
+            if return_move.state != "assigned":
+                failed_moves.append((line, return_move))
+                continue
+            qty_done_by_move[return_move] = qty_done_by_move.get(return_move, 0) + qty
+            returned_moves_by_line.setdefault(line, []).append(return_move.id)
         if failed_moves:
             failed_moves_str = "\n".join(
                 [
@@ -337,19 +407,130 @@ class StockReturnRequest(models.Model):
                     "%s" % failed_moves_str
                 )
             )
+        moves_by_qty_done = {}
+        for return_move, qty in qty_done_by_move.items():
+            moves_by_qty_done.setdefault(qty, self.env["stock.move"])
+            moves_by_qty_done[qty] |= return_move
+        for qty, moves in moves_by_qty_done.items():
+            moves.write({"quantity_done": qty})
+        self.write(
+            {
+                "line_ids": [
+                    (1, line.id, {"returnable_move_ids": [(4, x) for x in move_ids]})
+                    for line, move_ids in returned_moves_by_line.items()
+                ]
+            }
+        )
         # Finish move traceability
+        return_moves = new_moves
+        self._link_return_moves(return_moves)
+        # Make return pickings and link to the proper moves.
+        origin_pickings = return_moves.mapped("origin_returned_move_id.picking_id")
+        self.returned_picking_ids = self._create_picking(origin_pickings, return_moves)
+        self.write({"state": "confirmed", "confirm_error": False})
+
+    def _prepare_lot_move_lines(self, lot_allocations):
+        """Prepare the move lines for the lines with lots.
+
+        :param lot_allocations: dict with the return moves to process for
+                                each request line and source location
+        :returns: a tuple with the move lines values and the failed moves
+        """
+        vals_list = []
+        failed_moves = []
+        for (line, location), allocations in lot_allocations.items():
+            if location.usage != "internal":
+                vals_list += [
+                    dict(
+                        self._prepare_move_line_values(line, return_move, qty),
+                        move_id=return_move.id,
+                    )
+                    for qty, return_move in allocations
+                ]
+                continue
+            # We try to reserve the stock manually so we ensure there's
+            # enough to make the return.
+            try:
+                vals_list += self._reserve_lot_allocations(line, location, allocations)
+            except UserError:
+                failed_moves += [(line, x[1]) for x in allocations]
+        return vals_list, failed_moves
+
+    def _reserve_lot_allocations(self, line, location, allocations):
+        """Reserve at once the quants for all the return moves of a lot line
+        and split the reserved quants among them in order.
+
+        :param allocations: list of tuples with the qty and the return move
+        :returns: list of move lines values
+        """
+        quants = self.env["stock.quant"]._update_reserved_quantity(
+            line.product_id,
+            location,
+            sum(x[0] for x in allocations),
+            lot_id=line.lot_id,
+            strict=False,
+        )
+        precision = line.product_uom_id.rounding
+        quants = [[quant, qty] for quant, qty in quants]
+        vals_list = []
+        for qty, return_move in allocations:
+            while quants and float_compare(qty, 0, precision_rounding=precision) > 0:
+                quant = quants[0]
+                qty_quant = min(qty, quant[1])
+                vals_list.append(
+                    dict(
+                        self._prepare_move_line_values(
+                            line, return_move, qty_quant, quant[0]
+                        ),
+                        move_id=return_move.id,
+                    )
+                )
+                qty -= qty_quant
+                quant[1] -= qty_quant
+                if float_is_zero(quant[1], precision_rounding=precision):
+                    quants.pop(0)
+        return vals_list
+
+    def _link_return_moves(self, return_moves):
+        """Link the return moves to the chain of their origin moves writing
+        all the relations in a single query"""
+        origin_moves = return_moves.mapped("origin_returned_move_id")
+        # Prefetch the whole chain at once
+        origin_moves.mapped("move_dest_ids.returned_move_ids")
+        origin_moves.mapped("move_orig_ids.returned_move_ids")
+        links = set()
         for move in return_moves:
-            vals = {}
             origin_move = move.origin_returned_move_id
             move_orig_to_link = origin_move.move_dest_ids.mapped("returned_move_ids")
             move_dest_to_link = origin_move.move_orig_ids.mapped("returned_move_ids")
-            vals["move_orig_ids"] = [(4, m.id) for m in move_orig_to_link | origin_move]
-            vals["move_dest_ids"] = [(4, m.id) for m in move_dest_to_link]
-            move.write(vals)
-        # Make return pickings and link to the proper moves.
-        origin_pickings = return_moves.mapped("origin_returned_move_id.picking_id")
-        self.returned_picking_ids = self._create_picking(origin_pickings, return_moves)
-        self.state = "confirmed"
+            links |= {(m.id, move.id) for m in move_orig_to_link | origin_move}
+            links |= {(move.id, m.id) for m in move_dest_to_link}
+        if not links:
+            return
+        field = self.env["stock.move"]._fields["move_dest_ids"]
+        self.env["stock.move"].flush(["move_orig_ids", "move_dest_ids"])
+        query = """
+            INSERT INTO {table} ({orig}, {dest})
+            SELECT link.orig_id, link.dest_id
+            FROM (VALUES {values}) AS link(orig_id, dest_id)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table} rel
+                WHERE rel.{orig} = link.orig_id AND rel.{dest} = link.dest_id
+            )
+        """.format(
+            table=field.relation,
+            orig=field.column1,
+            dest=field.column2,
+            values=", ".join(["(%s, %s)"] * len(links)),
+        )
+        self.env.cr.execute(query, [x for link in links for x in link])
+        linked_moves = self.env["stock.move"].browse(
+            list({x for link in links for x in link})
+        )
+        linked_moves.invalidate_cache(
+            ["move_orig_ids", "move_dest_ids"], linked_moves.ids
+        )
+        linked_moves.modified(["move_orig_ids", "move_dest_ids"])
 
     def action_validate(self):
         """Wrapper for multi"""
@@ -400,6 +581,79 @@ class StockReturnRequest(models.Model):
             "stock_return_request" ".action_report_stock_return_request"
         ).report_action(self)
 
+    def _iter_returned_move_lines(self, chunk_size=1000):
+        """Yield the returned move lines in chunks of records prefetched
+        together, releasing them and their related records from the cache
+        once processed"""
+        self.ensure_one()
+        move_line_obj = self.env["stock.move.line"]
+        for ids in split_every(chunk_size, self.returned_picking_ids.move_line_ids.ids):
+            move_lines = move_line_obj.browse(ids)
+            pickings = move_lines.mapped("picking_id")
+            pickings.mapped("name")
+            products = move_lines.mapped("product_id")
+            products.mapped("display_name")
+            lots = move_lines.mapped("lot_id")
+            lots.mapped("name")
+            yield move_lines
+            move_line_obj.invalidate_cache(ids=list(ids))
+            pickings.invalidate_cache(ids=pickings.ids)
+            products.invalidate_cache(ids=products.ids)
+            products.product_tmpl_id.invalidate_cache(
+                ids=products.product_tmpl_id.ids
+            )
+            lots.invalidate_cache(ids=lots.ids)
+
+    def _get_export_header(self):
+        """Extend to add columns to the returned lines export"""
+        return [
+            _("Transfer"),
+            _("Product"),
+            _("Lot/Serial Number"),
+            _("Quantity"),
+            _("Unit of Measure"),
+        ]
+
+    def _prepare_export_row(self, move_line):
+        """Extend to add values to the returned lines export"""
+        return [
+            move_line.picking_id.name,
+            move_line.product_id.display_name,
+            move_line.lot_id.name or move_line.lot_name or "",
+            move_line.qty_done,
+            move_line.product_uom_id.name,
+        ]
+
+    def action_export_returned_lines(self):
+        """Export the returned lines to CSV writing them chunk by chunk to a
+        temporary file, so it can be used for requests too big to be printed.
+        The file content is only loaded in memory once to be stored in the
+        attachment."""
+        self.ensure_one()
+        with tempfile.TemporaryFile() as output:
+            text_output = io.TextIOWrapper(output, encoding="utf-8", newline="")
+            writer = csv.writer(text_output)
+            writer.writerow(self._get_export_header())
+            for move_lines in self._iter_returned_move_lines():
+                writer.writerows(self._prepare_export_row(x) for x in move_lines)
+            text_output.flush()
+            output.seek(0)
+            attachment = self.env["ir.attachment"].create(
+                {
+                    "name": "%s.csv" % self.name.replace("/", "_"),
+                    "raw": output.read(),
+                    "mimetype": "text/csv",
+                    "res_model": self._name,
+                    "res_id": self.id,
+                }
+            )
+            text_output.detach()
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/web/content/%s?download=true" % attachment.id,
+            "target": "self",
+        }
+
 
 class StockReturnRequestLine(models.Model):
     _name = "stock.return.request.line"
@@ -439,6 +693,7 @@ class StockReturnRequestLine(models.Model):
     max_quantity = fields.Float(
         string="Maximum available quantity",
         digits="Product Unit of Measure",
+        compute="_compute_max_quantity",
         readonly=True,
     )
     returnable_move_ids = fields.Many2many(
@@ -447,47 +702,85 @@ class StockReturnRequestLine(models.Model):
         copy=False,
         readonly=True,
     )
+    return_key = fields.Char(
+        compute="_compute_return_key",
+        store=True,
+        index=True,
+        help="Technical field to find other open requests for the same "
+        "product, lot, locations and commercial partner.",
+    )
+
+    @api.depends(
+        "product_id",
+        "lot_id",
+        "request_id.return_from_location",
+        "request_id.return_to_location",
+        "request_id.partner_id.commercial_partner_id",
+    )
+    def _compute_return_key(self):
+        for line in self:
+            request = line.request_id
+            # Requests without partner are never considered the same
+            if not request.partner_id:
+                line.return_key = False
+                continue
+            line.return_key = "{}-{}-{}-{}-{}".format(
+                line.product_id.id,
+                line.lot_id.id or 0,
+                request.return_from_location.id,
+                request.return_to_location.id,
+                request.partner_id.commercial_partner_id.id,
+            )
+
+    @api.depends(
+        "product_id",
+        "lot_id",
+        "request_id.return_type",
+        "request_id.return_from_location",
+    )
+    def _compute_max_quantity(self):
+        """Get the available quantities for all the lines at once, with one
+        grouped quants query by source location. The field isn't stored as
+        the quantities change with every move of stock."""
+        lines_by_location = {}
+        for line in self:
+            line.max_quantity = 0.0
+            if line.request_id.return_type == "customer" or not line.product_id:
+                continue
+            location = line.request_id.return_from_location
+            lines_by_location.setdefault(location, []).append(line)
+        for location, lines in lines_by_location.items():
+            groups = self.env["stock.quant"].read_group(
+                [
+                    ("location_id", "child_of", location.id),
+                    ("product_id", "in", list({x.product_id.id for x in lines})),
+                ],
+                ["quantity"],
+                ["product_id", "lot_id"],
+                lazy=False,
+            )
+            quantities = {
+                (x["product_id"][0], x["lot_id"] and x["lot_id"][0]): x["quantity"]
+                for x in groups
+            }
+            for line in lines:
+                line.max_quantity = quantities.get(
+                    (line.product_id.id, line.lot_id.id), 0.0
+                )
 
     def _get_moves_domain(self):
         """Domain constructor for moves search"""
         self.ensure_one()
-        domain = [
-            ("state", "=", "done"),
-            ("origin_returned_move_id", "=", False),
-            ("qty_returnable", ">", 0),
-            ("product_id", "=", self.product_id.id),
-        ]
+        domain = [("product_id", "=", self.product_id.id)]
         if not self.env.context.get("ignore_rr_lots"):
             domain += [("move_line_ids.lot_id", "=", self.lot_id.id)]
-        if self.request_id.from_date:
-            domain += [("date", ">=", self.request_id.from_date)]
-        if self.request_id.picking_types:
-            domain += [
-                ("picking_id.picking_type_id", "in", self.request_id.picking_types.ids)
-            ]
-        return_type = self.request_id.return_type
-        if return_type != "internal":
-            domain += [
-                (
-                    "picking_id.partner_id",
-                    "child_of",
-                    self.request_id.partner_id.commercial_partner_id.id,
-                )
-            ]
-        # Search for movements coming delivered to that location
-        if return_type in ["internal", "customer"]:
-            domain += [
-                ("location_dest_id", "=", self.request_id.return_from_location.id)
-            ]
-        # Return to supplier. Search for moves that came from that location
-        else:
-            domain += [
-                ("location_id", "child_of", self.request_id.return_to_location.id)
-            ]
-        return domain
+        return domain + self.request_id._get_moves_domain()
 
     def _get_returnable_move_ids(self):
-        """Gets returnable stock.moves for the given request conditions
+        """Gets returnable stock.moves for the given request conditions. The
+        candidate moves for all the lines of a request are fetched at once
+        and their done and returned quantities by lot are aggregated in a
+        single query.
 
         :returns: a dict with request lines as keys containing a list of tuples
                   with qty returnable for a given move as the move itself
@@ -495,119 +788,122 @@ class StockReturnRequestLine(models.Model):
         """
         moves_for_return = {}
         stock_move_obj = self.env["stock.move"]
+        ignore_lots = self.env.context.get("ignore_rr_lots")
         # Avoid lines with quantity to 0.0
-        for line in self.filtered("quantity"):
-            moves_for_return[line] = []
-            precision = line.product_uom_id.rounding
+        lines = self.filtered("quantity")
+        for request in lines.mapped("request_id"):
+            request_lines = lines.filtered(lambda x: x.request_id == request)
             moves = stock_move_obj.search(
-                line._get_moves_domain(), order=line.request_id.return_order
+                request._get_moves_domain()
+                + [("product_id", "in", request_lines.mapped("product_id").ids)],
+                order=request.return_order,
             )
-            # Add moves up to desired quantity
-            qty_to_complete = line.quantity
+            moves_by_product = {}
             for move in moves:
-                qty_returned = 0
-                return_moves = move.returned_move_ids.filtered(
-                    lambda x: x.state == "done"
+                moves_by_product.setdefault(move.product_id, []).append(move)
+            done_qty, returned_qty = moves._get_lot_done_quantities()
+            for line in request_lines:
+                moves_for_return[line] = line._allocate_returnable_moves(
+                    moves_by_product.get(line.product_id, []),
+                    done_qty,
+                    returned_qty,
+                    ignore_lots=ignore_lots,
                 )
-                # Don't count already returned
-                if return_moves:
-                    qty_returned = -sum(
-                        return_moves.mapped("move_line_ids")
-                        .filtered(lambda x: x.lot_id == line.lot_id)
-                        .mapped("qty_done")
-                    )
-                quantity_done = sum(
-                    move.mapped("move_line_ids")
-                    .filtered(lambda x: x.lot_id == line.lot_id)
-                    .mapped("qty_done")
-                )
-                qty_remaining = quantity_done - qty_returned
-                # We add the move to the list if there are units that haven't
-                # been returned
-                if float_compare(qty_remaining, 0.0, precision_rounding=precision) > 0:
-                    qty_to_return = min(qty_to_complete, qty_remaining)
-                    moves_for_return[line] += [(qty_to_return, move)]
-                    qty_to_complete -= qty_to_return
-                if float_is_zero(qty_to_complete, precision_rounding=precision):
-                    break
-            if qty_to_complete:
-                qty_found = line.quantity - qty_to_complete
-                raise ValidationError(
-                    _(
-                        "Not enough moves to return this product.\n"
-                        "It wasn't possible to find enough moves to return %f %s"
-                        "of %s. A maximum of %f can be returned."
-                        % (
-                            line.quantity,
-                            line.product_uom_id.name,
-                            line.product_id.display_name,
-                            qty_found,
-                        )
+        return moves_for_return
+
+    def _allocate_returnable_moves(
+        self, moves, done_qty, returned_qty, ignore_lots=False
+    ):
+        """Greedy allocation of the line quantity over the given ordered
+        moves.
+
+        :param moves: candidate moves in the request return order
+        :param done_qty: done quantities by (move id, lot id)
+        :param returned_qty: returned quantities by (move id, lot id)
+        :returns: a list of tuples with the qty to return and the move
+        """
+        self.ensure_one()
+        res = []
+        precision = self.product_uom_id.rounding
+        lot_key = self.lot_id.id or False
+        # Add moves up to desired quantity
+        qty_to_complete = self.quantity
+        for move in moves:
+            key = (move.id, lot_key)
+            if not ignore_lots and key not in done_qty:
+                continue
+            # Don't count already returned
+            qty_returned = -returned_qty.get(key, 0.0)
+            qty_remaining = done_qty.get(key, 0.0) - qty_returned
+            # We add the move to the list if there are units that haven't
+            # been returned
+            if float_compare(qty_remaining, 0.0, precision_rounding=precision) > 0:
+                qty_to_return = min(qty_to_complete, qty_remaining)
+                res += [(qty_to_return, move)]
+                qty_to_complete -= qty_to_return
+            if float_is_zero(qty_to_complete, precision_rounding=precision):
+                break
+        if qty_to_complete:
+            qty_found = self.quantity - qty_to_complete
+            raise ValidationError(
+                _(
+                    "Not enough moves to return this product.\n"
+                    "It wasn't possible to find enough moves to return %f %s"
+                    "of %s. A maximum of %f can be returned."
+                    % (
+                        self.quantity,
+                        self.product_uom_id.name,
+                        self.product_id.display_name,
+                        qty_found,
                     )
                 )
-        return moves_for_return
+            )
+        return res
 
-    @api.model
-    def create(self, values):
-        res = super().create(values)
-        existing = self.search(
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        res._check_open_request_duplicates()
+        return res
+
+    def _check_open_request_duplicates(self):
+        """Check with one grouped query that there aren't other open requests
+        for the same products and lots"""
+        keys = list(set(self.filtered("return_key").mapped("return_key")))
+        if not keys:
+            return
+        groups = self.read_group(
             [
-                ("product_id", "=", res.product_id.id),
+                ("return_key", "in", keys),
                 ("request_id.state", "in", ["draft", "confirm"]),
-                (
-                    "request_id.return_from_location",
-                    "=",
-                    res.request_id.return_from_location.id,
-                ),
-                (
-                    "request_id.return_to_location",
-                    "=",
-                    res.request_id.return_to_location.id,
-                ),
-                (
-                    "request_id.partner_id",
-                    "child_of",
-                    res.request_id.partner_id.commercial_partner_id.id,
-                ),
-                ("lot_id", "=", res.lot_id.id),
-            ]
+            ],
+            ["return_key"],
+            ["return_key"],
         )
-        if len(existing) > 1:
-            raise UserError(
-                _(
-                    """
+        duplicated_keys = {x["return_key"] for x in groups if x["return_key_count"] > 1}
+        if not duplicated_keys:
+            return
+        res = self.filtered(lambda x: x.return_key in duplicated_keys)[:1]
+        raise UserError(
+            _(
+                """
                 You cannot have two open Stock Return Requests with the same
                 product (%s), locations (%s, %s) partner (%s) and lot.\n
                 Please first validate the first return request with this
                 product before creating a new one.
                 """
-                )
-                % (
-                    res.product_id.display_name,
-                    res.request_id.return_from_location.display_name,
-                    res.request_id.return_to_location.display_name,
-                    res.request_id.partner_id.name,
-                )
             )
-        return res
+            % (
+                res.product_id.display_name,
+                res.request_id.return_from_location.display_name,
+                res.request_id.return_to_location.display_name,
+                res.request_id.partner_id.name,
+            )
+        )
 
     @api.onchange("product_id", "lot_id")
     def onchange_product_id(self):
         self.product_uom_id = self.product_id.uom_id
-        request = self.request_id
-        if request.return_type == "customer":
-            return
-        search_args = [
-            ("location_id", "child_of", request.return_from_location.id),
-            ("product_id", "=", self.product_id.id),
-        ]
-        if self.lot_id:
-            search_args.append(("lot_id", "=", self.lot_id.id))
-        else:
-            search_args.append(("lot_id", "=", False))
-        res = self.env["stock.quant"].read_group(search_args, ["quantity"], [])
-        max_quantity = res[0]["quantity"]
-        self.max_quantity = max_quantity
 
     def action_lot_suggestion(self):
         return {
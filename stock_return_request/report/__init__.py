@@ -0,0 +1 @@
+from . import stock_return_report
@@ -0,0 +1,32 @@
+# Copyright 2019 Tecnativa - David Vidal
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from odoo import api, models
+
+
+class StockReturnRequestReport(models.AbstractModel):
+    _name = "report.stock_return_request.report_stock_return_request"
+    _description = "Stock Return Request Report"
+
+    @api.model
+    def _has_lots(self, request):
+        return bool(
+            self.env["stock.move.line"].search_count(
+                [
+                    ("picking_id", "in", request.returned_picking_ids.ids),
+                    ("lot_id", "!=", False),
+                ]
+            )
+        )
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        """Feed the returned move lines to the template in chunks, so big
+        requests don't keep every line in the cache while rendering"""
+        docs = self.env["stock.return.request"].browse(docids)
+        return {
+            "doc_ids": docids,
+            "doc_model": "stock.return.request",
+            "docs": docs,
+            "has_lots": self._has_lots,
+            "get_move_line_chunks": lambda x: x._iter_returned_move_lines(),
+        }
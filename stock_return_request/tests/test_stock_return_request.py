@@ -1,5 +1,9 @@
 # Copyright 2019 Tecnativa - David Vidal
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import base64
+
+from odoo.exceptions import UserError, ValidationError
+
 from .test_stock_return_request_common import StockReturnRequestCase
 
 
@@ -214,3 +218,229 @@ class PurchaseReturnRequestCase(StockReturnRequestCase):
         self.assertEqual(
             stock_move_lines.mapped("location_dest_id"), self.location_child_1
         )
+
+    def test_returnable_moves_allocation_several_products(self):
+        """All the lines of a request are allocated in one go"""
+        self.return_request_supplier.write(
+            {
+                "line_ids": [
+                    (0, 0, {"product_id": self.prod_1.id, "quantity": 12.0}),
+                    (0, 0, {"product_id": self.prod_2.id, "quantity": 25.0}),
+                    (
+                        0,
+                        0,
+                        {
+                            "product_id": self.prod_3.id,
+                            "lot_id": self.prod_3_lot1.id,
+                            "quantity": 30.0,
+                        },
+                    ),
+                ],
+            }
+        )
+        returnable_moves = (
+            self.return_request_supplier.line_ids._get_returnable_move_ids()
+        )
+        for line, moves in returnable_moves.items():
+            self.assertAlmostEqual(sum(qty for qty, move in moves), line.quantity)
+            self.assertTrue(
+                all(move.product_id == line.product_id for _q, move in moves)
+            )
+        line_3 = self.return_request_supplier.line_ids.filtered(
+            lambda x: x.product_id == self.prod_3
+        )
+        # Older first: 20 units of the lot from the first picking and 10 from
+        # the second one.
+        self.assertEqual([qty for qty, _move in returnable_moves[line_3]], [20.0, 10.0])
+
+    def test_returnable_moves_not_enough(self):
+        self.return_request_supplier.write(
+            {"line_ids": [(0, 0, {"product_id": self.prod_1.id, "quantity": 500.0})]}
+        )
+        with self.assertRaises(ValidationError):
+            self.return_request_supplier.action_confirm()
+
+    def test_return_moves_traceability(self):
+        """Return moves are linked to their origin moves and request lines"""
+        self.return_request_supplier.write(
+            {
+                "line_ids": [
+                    (0, 0, {"product_id": self.prod_1.id, "quantity": 12.0}),
+                    (
+                        0,
+                        0,
+                        {
+                            "product_id": self.prod_3.id,
+                            "lot_id": self.prod_3_lot1.id,
+                            "quantity": 30.0,
+                        },
+                    ),
+                ],
+            }
+        )
+        self.return_request_supplier.action_confirm()
+        moves = self.return_request_supplier.returned_picking_ids.mapped("move_lines")
+        self.assertEqual(
+            moves, self.return_request_supplier.line_ids.mapped("returnable_move_ids")
+        )
+        for move in moves:
+            self.assertIn(move.origin_returned_move_id, move.move_orig_ids)
+            self.assertIn(move, move.origin_returned_move_id.move_dest_ids)
+        lot_moves = moves.filtered(lambda x: x.product_id == self.prod_3)
+        self.assertAlmostEqual(sum(lot_moves.mapped("move_line_ids.qty_done")), 30.0)
+        self.assertEqual(lot_moves.mapped("move_line_ids.lot_id"), self.prod_3_lot1)
+
+    def test_qty_returnable_chain(self):
+        """The origin move returnable qty follows its returns and the checker
+        can rebuild a corrupted value"""
+        self.return_request_supplier.write(
+            {"line_ids": [(0, 0, {"product_id": self.prod_1.id, "quantity": 4.0})]}
+        )
+        self.return_request_supplier.action_confirm()
+        self.return_request_supplier.action_validate()
+        return_move = self.return_request_supplier.returned_picking_ids.move_lines
+        origin_move = return_move.origin_returned_move_id
+        self.assertAlmostEqual(return_move.qty_returnable, 4.0)
+        self.assertAlmostEqual(origin_move.qty_returnable, 6.0)
+        move_obj = self.env["stock.move"]
+        date_from = origin_move.date
+        self.assertFalse(move_obj._check_qty_returnable(date_from=date_from))
+        self.env.cr.execute(
+            "UPDATE stock_move SET qty_returnable = 10 WHERE id = %s",
+            (origin_move.id,),
+        )
+        origin_move.invalidate_cache(["qty_returnable"])
+        wrong = move_obj._check_qty_returnable(date_from=date_from, fix=True)
+        self.assertEqual(wrong, {origin_move.id: (10.0, 6.0)})
+        self.assertAlmostEqual(origin_move.qty_returnable, 6.0)
+        self.assertFalse(move_obj._check_qty_returnable(date_from=date_from))
+
+    def test_suggest_lots(self):
+        self.return_request_supplier.write(
+            {"line_ids": [(0, 0, {"product_id": self.prod_3.id, "quantity": 5.0})]}
+        )
+        line = self.return_request_supplier.line_ids
+        wizard_obj = self.env["suggest.return.request.lot"].with_context(
+            active_model="stock.return.request.line", active_id=line.id
+        )
+        suggested_lots, _suggested_moves = wizard_obj._get_suggested_lots_data()
+        self.assertAlmostEqual(suggested_lots[self.prod_3_lot1], 90.0)
+        self.assertAlmostEqual(suggested_lots[self.prod_3_lot2], 10.0)
+        # Suggestions are bound to the caller environment
+        other_wizard_obj = wizard_obj.with_context(lang="en_US")
+        suggested_lots, _suggested_moves = other_wizard_obj._get_suggested_lots_data()
+        self.assertEqual(
+            next(iter(suggested_lots)).env.context, other_wizard_obj.env.context
+        )
+        # Editing the line doesn't return stale suggestions
+        line.product_id = self.prod_1
+        suggested_lots, _suggested_moves = wizard_obj._get_suggested_lots_data()
+        self.assertNotIn(self.prod_3_lot1, suggested_lots)
+        self.assertNotIn(self.prod_3_lot2, suggested_lots)
+
+    def test_open_request_duplicates(self):
+        self.return_request_supplier.write(
+            {
+                "line_ids": [
+                    (0, 0, {"product_id": self.prod_1.id, "quantity": 1.0}),
+                    (0, 0, {"product_id": self.prod_2.id, "quantity": 1.0}),
+                ]
+            }
+        )
+        other_request = self.return_request_supplier.copy({"line_ids": False})
+        line_obj = self.env["stock.return.request.line"]
+        with self.assertRaises(UserError):
+            line_obj.create(
+                [
+                    {
+                        "request_id": other_request.id,
+                        "product_id": self.prod_3.id,
+                        "quantity": 1.0,
+                    },
+                    {
+                        "request_id": other_request.id,
+                        "product_id": self.prod_2.id,
+                        "quantity": 1.0,
+                    },
+                ]
+            )
+        # Other lots are fine
+        line_obj.create(
+            {
+                "request_id": other_request.id,
+                "product_id": self.prod_3.id,
+                "lot_id": self.prod_3_lot1.id,
+                "quantity": 1.0,
+            }
+        )
+
+    def test_max_quantity(self):
+        """Available quantities are computed for lines not created from the
+        UI as well"""
+        lines = self.env["stock.return.request.line"].create(
+            [
+                {
+                    "request_id": self.return_request_supplier.id,
+                    "product_id": self.prod_1.id,
+                    "quantity": 1.0,
+                },
+                {
+                    "request_id": self.return_request_supplier.id,
+                    "product_id": self.prod_3.id,
+                    "lot_id": self.prod_3_lot1.id,
+                    "quantity": 1.0,
+                },
+            ]
+        )
+        self.assertAlmostEqual(lines[0].max_quantity, 80.0)
+        self.assertAlmostEqual(lines[1].max_quantity, 90.0)
+        # The quantities follow the stock of the location
+        self.env["stock.quant"]._update_available_quantity(
+            self.prod_1, self.return_request_supplier.return_from_location, 5.0
+        )
+        lines.invalidate_cache(["max_quantity"])
+        self.assertAlmostEqual(lines[0].max_quantity, 85.0)
+
+    def test_report_and_export(self):
+        self.return_request_customer.write(
+            {"line_ids": [(0, 0, {"product_id": self.prod_1.id, "quantity": 12.0})]}
+        )
+        self.return_request_customer.action_confirm()
+        report = self.env.ref("stock_return_request.action_report_stock_return_request")
+        html = report._render_qweb_html(self.return_request_customer.ids)[0]
+        self.assertIn(self.prod_1.name, html.decode())
+        action = self.return_request_customer.action_export_returned_lines()
+        attachment = self.env["ir.attachment"].browse(
+            int(action["url"].split("/")[-1].split("?")[0])
+        )
+        rows = base64.b64decode(attachment.datas).decode().splitlines()
+        move_lines = self.return_request_customer.returned_picking_ids.move_line_ids
+        # Header and one row per returned line
+        self.assertEqual(len(rows), len(move_lines) + 1)
+
+    def test_queue_confirm(self):
+        """Every queued request is confirmed on its own"""
+        self.return_request_customer.write(
+            {"line_ids": [(0, 0, {"product_id": self.prod_1.id, "quantity": 12.0})]}
+        )
+        # No lines to return
+        failing_request = self.return_request_supplier
+        requests = self.return_request_customer | failing_request
+        requests.action_queue_confirm()
+        self.assertTrue(all(requests.mapped("confirm_queued")))
+        self.env["stock.return.request"]._cron_confirm_queued()
+        self.assertEqual(self.return_request_customer.state, "confirmed")
+        self.assertFalse(self.return_request_customer.confirm_error)
+        self.assertEqual(failing_request.state, "draft")
+        self.assertTrue(failing_request.confirm_error)
+        self.assertFalse(any(requests.mapped("confirm_queued")))
+
+    def test_picking_commercial_partner(self):
+        contact = self.env["res.partner"].create(
+            {"name": "Supplier contact", "parent_id": self.partner_supplier.id}
+        )
+        picking = self.picking_supplier_1.copy({"partner_id": contact.id})
+        self.assertEqual(
+            picking.move_lines.mapped("picking_commercial_partner_id"),
+            self.partner_supplier,
+        )
@@ -39,7 +39,11 @@ class SuggestReturnRequestLot(models.TransientModel):
         return self.env.context.get("active_id", False)
 
     def _get_suggested_lots_data(self):
-        """Returns dict with returnable lots and qty"""
+        """Returns dict with returnable lots and qty. The result is kept in
+        the cursor cache as it's needed several times to render the wizard.
+        It's keyed on the line search criteria and their last update, and
+        dropped when moves are done. Only ids are kept so no record from
+        another environment leaks to the caller."""
         if self.env.context.get("active_model", False) != "stock.return.request.line":
             return (False, False)
         request_line = self.request_line_id or self.request_line_id.browse(
@@ -47,14 +51,51 @@ class SuggestReturnRequestLot(models.TransientModel):
         )
         if not request_line:
             return (False, False)
+        cache = self.env.cr.cache.setdefault("suggest_return_request_lot", {})
+        key = self._get_suggested_lots_cache_key(request_line)
+        if key not in cache:
+            suggested_lots_totals, suggested_lots_moves = (
+                self._compute_suggested_lots_data(request_line)
+            )
+            cache[key] = (
+                [(lot.id, qty) for lot, qty in suggested_lots_totals.items()],
+                [(ml.id, qty) for ml, qty in suggested_lots_moves.items()],
+            )
+        lot_obj = self.env["stock.production.lot"]
+        move_line_obj = self.env["stock.move.line"]
+        suggested_lots_totals, suggested_lots_moves = cache[key]
+        return (
+            {lot_obj.browse(lot_id): qty for lot_id, qty in suggested_lots_totals},
+            {move_line_obj.browse(ml_id): qty for ml_id, qty in suggested_lots_moves},
+        )
+
+    @api.model
+    def _get_suggested_lots_cache_key(self, request_line):
+        request = request_line.request_id
+        return (
+            request_line.id,
+            request_line.product_id.id,
+            request_line.lot_id.id,
+            request_line.write_date,
+            request.return_from_location.id,
+            request.return_to_location.id,
+            request.write_date,
+            self.env.uid,
+            tuple(self.env.companies.ids),
+        )
+
+    @api.model
+    def _compute_suggested_lots_data(self, request_line):
         moves = self.env["stock.move"].search(
             request_line.with_context(ignore_rr_lots=True)._get_moves_domain(),
             order=request_line.request_id.return_order,
         )
+        returnable_qty = moves._get_lots_returnable_qty()
         suggested_lots_totals = {}
         suggested_lots_moves = {}
         for line in moves.mapped("move_line_ids"):
-            qty = line.move_id._get_lot_returnable_qty(line.lot_id)
+            key = (line.move_id.id, line.lot_id.id)
+            qty = returnable_qty.get(key, 0.0)
             suggested_lots_moves[line] = qty
             suggested_lots_totals.setdefault(line.lot_id, 0)
             suggested_lots_totals[line.lot_id] += qty